@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Benchmark the stages of making maps of the NYC Covid-19 data, from reading
+the coronavirus-data repository to rendering svgs, on a synthetic repository.
+
+The synthetic repository has one commit per day, each with a
+data-by-modzcta.csv of random (but plausible) data, and is made offline with
+a single 'git fast-import'. Its ZCTAs are those of nychealth's map, followed
+by made-up ones if more are asked for; the rendering stages only use the
+ZCTAs of the map, and are skipped if some of them are missing.
+
+Each stage is timed (the best of a number of runs), and its peak memory use
+is measured with tracemalloc in a separate run. The results are written as
+JSON, so that runs can be compared. Run it from anywhere with, e.g.
+
+    python benchmarks/bench_pipeline.py --commits 200 --zctas 177 --output results.json
+
+This needs git, gitpython and matplotlib, but no network access.
+
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+import clean_data
+import derived_metrics
+import map_geometry
+import svg_utilities
+import zcta_store
+
+def map_zctas(map_filename=os.path.join(repo_dir, 'NYCmap06-12.svg')):
+    r'''
+    Get the ZCTAs of nychealth's map, in the order they are drawn.
+    '''
+    return map_geometry.load_map_geometry(map_filename).zctas
+
+def make_synthetic_repo(path, n_commits=100, n_zctas=177, seed=0):
+    r'''
+    Make a git repository like nychealth's coronavirus-data, with one commit
+    of data-by-modzcta.csv per day starting on 2020-04-01.
+
+    Parameters
+    ----------
+    path : str
+        Folderpath of the repository to create.
+    n_commits : int, optional
+        The number of commits (and so of days).
+        The default is 100.
+    n_zctas : int, optional
+        The number of ZCTAs in each csv. The first (up to) 177 are those of
+        nychealth's map.
+        The default is 177.
+    seed : int, optional
+        The seed of the random data.
+        The default is 0.
+
+    Returns
+    -------
+    zctas : list
+        The ZCTAs of the data.
+
+    '''
+    zctas = map_zctas()
+    zctas = zctas[:n_zctas] + list(range(zctas[-1] + 1, zctas[-1] + 1 + n_zctas - len(zctas)))
+    rng = np.random.default_rng(seed)
+    population = rng.integers(3000, 100000, len(zctas)).astype(float)
+    cases = rng.integers(10, 100, len(zctas))
+    deaths = np.zeros(len(zctas), dtype=int)
+
+    # Write all the commits as one fast-import stream
+    subprocess.run(['git', 'init', '-q', path], check=True)
+    stream = io.BytesIO()
+    start = pd.Timestamp('2020-04-01 20:00', tz='UTC')
+    for k in range(n_commits):
+        date = start + pd.Timedelta(days=k)
+        cases = cases + rng.integers(0, 30, len(zctas))
+        deaths = deaths + rng.integers(0, 3, len(zctas))
+        data = pd.DataFrame({'MODIFIED_ZCTA': zctas,
+                             'NEIGHBORHOOD_NAME': ['Neighborhood %s'%(zcta) for zcta in zctas],
+                             'BOROUGH_GROUP': 'Borough',
+                             'COVID_CASE_COUNT': cases,
+                             'COVID_CASE_RATE': np.round(100000 * cases / population, 2),
+                             'POP_DENOMINATOR': population,
+                             'COVID_DEATH_COUNT': deaths,
+                             'COVID_DEATH_RATE': np.round(100000 * deaths / population, 2),
+                             'PERCENT_POSITIVE': np.round(rng.uniform(5, 40, len(zctas)), 2)})
+        csv = data.to_csv(index=False).encode('utf-8')
+        message = ('Update data %s/%s\n'%(date.month, date.day)).encode('utf-8')
+        stream.write(b'commit refs/heads/master\n')
+        stream.write(b'committer Benchmark <benchmark@example.com> %d +0000\n'%(date.timestamp()))
+        stream.write(b'data %d\n%s\n'%(len(message), message))
+        stream.write(b'M 644 inline data-by-modzcta.csv\ndata %d\n%s\n'%(len(csv), csv))
+    subprocess.run(['git', '-C', path, 'fast-import', '--quiet'], input=stream.getvalue(), check=True)
+    subprocess.run(['git', '-C', path, 'symbolic-ref', 'HEAD', 'refs/heads/master'], check=True)
+    return zctas
+
+def time_stage(results, name, function, repeat=3, memory=True, count=None, unit=None):
+    r'''
+    Time a stage and record its result in 'results'.
+
+    Parameters
+    ----------
+    results : dict
+        The results so far, to which the stage's are added under 'name'.
+    name : str
+        The name of the stage.
+    function : function
+        The stage, taking no arguments.
+    repeat : int, optional
+        The number of timed runs. The best is kept.
+        The default is 3.
+    memory : boolean, optional
+        Whether to make an extra run to measure peak memory use.
+        The default is True.
+    count : int, optional
+        The number of items (e.g. frames) processed by the stage, to compute
+        its throughput.
+        The default is None.
+    unit : str, optional
+        The name of the items, e.g. 'frames'.
+        The default is None.
+
+    Returns
+    -------
+    The value returned by the stage.
+
+    '''
+    seconds = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        seconds.append(time.perf_counter() - start)
+    result = {'seconds': min(seconds), 'runs': seconds}
+    if count is not None:
+        result[unit] = count
+        result[unit + '_per_sec'] = count / min(seconds)
+    if memory:
+        tracemalloc.start()
+        function()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results[name] = result
+    return value
+
+def run_benchmark(n_commits=100, n_zctas=177, n_frames=20, repeat=3, workers=None, memory=True, colormap='coolwarm', work_dir=None):
+    r'''
+    Run every stage on a new synthetic repository.
+
+    Parameters
+    ----------
+    n_commits : int, optional
+        The number of commits of the synthetic repository.
+        The default is 100.
+    n_zctas : int, optional
+        The number of ZCTAs of the synthetic repository.
+        The default is 177, those of nychealth's map.
+    n_frames : int, optional
+        The number of frames rendered by the rendering stages.
+        The default is 20.
+    repeat : int, optional
+        The number of timed runs of each stage.
+        The default is 3.
+    workers : int, optional
+        The number of processes used by the multi-frame render.
+        The default is None. The frames are then rendered serially.
+    memory : boolean, optional
+        Whether to measure the peak memory use of each stage.
+        The default is True.
+    colormap : str, optional
+        The colormap of the renders.
+        The default is 'coolwarm'.
+    work_dir : str, optional
+        Folderpath in which to make the repository and render. It is
+        removed afterwards.
+        The default is None. A temporary directory is then used.
+
+    Returns
+    -------
+    dict
+        The parameters, the environment and the result of each stage.
+
+    '''
+    work_dir = tempfile.mkdtemp(prefix='bench_pipeline_', dir=work_dir)
+    cwd = os.getcwd()
+    try:
+        data_dir = os.path.join(work_dir, 'coronavirus-data')
+        start = time.perf_counter()
+        make_synthetic_repo(data_dir, n_commits, n_zctas)
+        results = {'make_repo': {'seconds': time.perf_counter() - start}}
+
+        from git import Repo
+        repo = Repo(data_dir)
+        commit_history = time_stage(results, 'metadata_scan', lambda: clean_data.read_commit_history(repo), repeat, memory, n_commits, 'commits')
+        commits = list(zip(commit_history['COMMIT'], commit_history['DATA_DATE']))
+        blobs = time_stage(results, 'blob_fetch', lambda: [clean_data.read_blob_from_git(repo, commit, 'data-by-modzcta.csv') for commit, date in commits], repeat, memory, len(commits), 'commits')
+        results['blob_fetch']['bytes'] = sum(len(blob) for blob in blobs)
+        raw = time_stage(results, 'csv_parse', lambda: [clean_data.parse_zcta_data(blob, date) for blob, (commit, date) in zip(blobs, commits)], repeat, memory, len(commits), 'commits')
+        # Only reading the files, with the dtypes inferred (as
+        # 'clean_data.parse_zcta_data' does before applying its schema) and
+        # with the schema declared to read_csv
+        dtypes = clean_data.zcta_data_schemas['data-by-modzcta.csv']
+        time_stage(results, 'csv_read_inferred_dtypes', lambda: [pd.read_csv(io.BytesIO(blob)) for blob in blobs], repeat, memory, len(commits), 'commits')
+        time_stage(results, 'csv_read_declared_dtypes', lambda: [pd.read_csv(io.BytesIO(blob), dtype=dtypes) for blob in blobs], repeat, memory, len(commits), 'commits')
+        data = time_stage(results, 'cleaning', lambda: clean_data.clean_zcta_data(clean_data.concat_zcta_data(raw)), repeat, memory, len(commits), 'commits')
+        time_stage(results, 'ingest', lambda: clean_data.read_all_zcta_data(data_dir), repeat, memory, len(commits), 'commits')
+        cache_dir = os.path.join(work_dir, 'cache')
+        clean_data.read_all_zcta_data(data_dir, cache_dir=cache_dir)
+        time_stage(results, 'ingest_cached', lambda: clean_data.read_all_zcta_data(data_dir, cache_dir=cache_dir), repeat, memory, len(commits), 'commits')
+
+        # Out of core, into a store partitioned by date, then read back a
+        # window at a time
+        store_dir = os.path.join(work_dir, 'store')
+        def write_store():
+            shutil.rmtree(store_dir, ignore_errors=True)
+            zcta_store.write_zcta_store(data_dir, store_dir)
+        time_stage(results, 'ingest_store', write_store, repeat, memory, len(commits), 'commits')
+        def read_store_windows():
+            for dates, window in zcta_store.iter_zcta_store_windows(store_dir, lookback_days=4):
+                pass
+        time_stage(results, 'store_window_read', read_store_windows, repeat, memory, len(commits), 'commits')
+
+        # As in make_SMA_diff_svgs.py
+        plot_field = 'COVID_CASE_RATE_DIFF_SMA3'
+        data = time_stage(results, 'derived_metrics', lambda: derived_metrics.add_derived_metrics(data, ['COVID_CASE_RATE'], sma_windows=(3,), growth_periods=()), repeat, memory, len(commits), 'commits')
+
+        # Render only the ZCTAs of the map
+        if n_zctas < len(map_zctas()):
+            results['frame_render'] = results['multi_frame_render'] = {'skipped': 'fewer ZCTAs than the map'}
+        else:
+            data = data[data.index.get_level_values(0).isin(map_zctas())]
+            data.index = data.index.remove_unused_levels()
+            os.chdir(work_dir)
+            shutil.copy(os.path.join(repo_dir, 'NYCmap06-12.svg'), work_dir)
+            svg_utilities.initalize_template_file(colormap=colormap)
+            dates = data.index.levels[1][3:3 + n_frames]
+            days = [data.loc[pd.IndexSlice[:, date], :] for date in dates]
+            def render_frames():
+                for day in days:
+                    svg_utilities.mi_generate_svg_from_day_dataframe(day, plot_field=plot_field, min_rate=-50, max_rate=50, colormap=colormap, outfile=io.BytesIO())
+            time_stage(results, 'frame_render', render_frames, repeat, memory, len(dates), 'frames')
+            os.makedirs('frames', exist_ok=True)
+            # With workers, only the memory of this process is measured
+            time_stage(results, 'multi_frame_render', lambda: svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data, plot_field=plot_field, filename_prefix='frames/NYC', colormap=colormap, dates=dates, min_rate=-50, max_rate=50, verbose=False, workers=workers), repeat, memory, len(dates), 'frames')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'parameters': {'commits': n_commits, 'zctas': n_zctas, 'frames': n_frames, 'repeat': repeat, 'workers': workers, 'colormap': colormap},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                        'git': subprocess.run(['git', '--version'], stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()},
+        'stages': results,
+        # On Linux ru_maxrss is in kilobytes
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark reading, cleaning and rendering the NYC Covid-19 data on a synthetic repository.')
+    parser.add_argument('--commits', type=int, default=100, help='number of commits of the synthetic repository')
+    parser.add_argument('--zctas', type=int, default=177, help='number of ZCTAs of the synthetic repository')
+    parser.add_argument('--frames', type=int, default=20, help='number of frames to render')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each stage')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes of the multi-frame render')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure the peak memory use of each stage")
+    parser.add_argument('--output', default=None, help='file to write the results to, rather than the standard output')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.commits, args.zctas, args.frames, args.repeat, args.workers, not args.no_memory)
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
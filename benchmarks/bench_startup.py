@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Measure how long it takes to start a process that uses 'svg_utilities' and
+'clean_data', with python's -X importtime.
+
+Each scenario is run in a fresh interpreter a few times, and the best total
+import time (in ms) is reported as JSON, along with whether any of the
+modules that should only be imported on demand (pyplot, gitpython) were
+imported. Run it from the repository's directory with, e.g.
+
+    python benchmarks/bench_startup.py --repeat 5
+
+It exits with status 1 if one of those modules was imported.
+
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+# Code run by each scenario, in a fresh interpreter
+scenarios = {
+    'import svg_utilities': 'import svg_utilities',
+    'import clean_data': 'import clean_data',
+    'import all': 'import svg_utilities, clean_data, zcta_arrays, derived_metrics, map_geometry, raster_animation, map_server, watcher, zcta_store',
+}
+
+# Modules that no scenario should import
+deferred_modules = ['matplotlib.pyplot', 'git', 'concurrent.futures.process']
+
+def import_times(code, repo_dir):
+    r'''
+    Run some code in a fresh interpreter with -X importtime.
+
+    Returns
+    -------
+    times : dict
+        The cumulative import time of each imported module, in microseconds.
+    top_level : list
+        The modules imported directly by the code (rather than by other
+        modules), whose times add up to the total.
+
+    '''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    top_level = []
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s*(\d+) \|\s*(\d+) \| ( *)(\S+)', line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+            if not match.group(3):
+                top_level.append(match.group(4))
+    return times, top_level
+
+def run_benchmark(repeat=5, repo_dir=None):
+    r'''
+    Run every scenario 'repeat' times.
+
+    Parameters
+    ----------
+    repeat : int, optional
+        The number of runs of each scenario. The best is kept.
+        The default is 5.
+    repo_dir : str, optional
+        Folderpath of the repository.
+        The default is None. The parent directory of this file is then used.
+
+    Returns
+    -------
+    dict
+        For each scenario, its best total import time in ms, the slowest
+        modules it imports at the top level, and the deferred modules it
+        imports.
+
+    '''
+    if repo_dir is None:
+        repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for name, code in scenarios.items():
+        runs = [import_times(code, repo_dir) for i in range(repeat)]
+        totals = [sum(times[module] for module in top_level) for times, top_level in runs]
+        times, top_level = runs[totals.index(min(totals))]
+        results[name] = {
+            'total_ms': round(min(totals) / 1000, 1),
+            'slowest_ms': {module: round(times[module] / 1000, 1) for module in sorted(top_level, key=lambda module: -times[module])[:5]},
+            'deferred_imported': [module for module in deferred_modules if module in times],
+        }
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the import time of the modules of this repository.')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each scenario')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.repeat)
+    print(json.dumps(results, indent=2))
+    if any(result['deferred_imported'] for result in results.values()):
+        sys.exit(1)
@@ -8,15 +8,59 @@ This script needs an installation of gitpython.  To install it, run
 
 conda install -c conda-forge gitpython
 
+gitpython is only imported when data is actually read from the repository,
+so loading data cached by 'read_all_zcta_data' doesn't need it.
+
 """
 
+import os
+import json
+import shutil
 import datetime
-from io import StringIO
+import subprocess
+from io import BytesIO
+from collections import deque, namedtuple
+import numpy as np
 import pandas as pd
-from git import Repo
-from git import GitCommandError
 
-def read_all_zcta_data(data_dir = '../coronavirus-data/'):
+import instrumentation
+
+# Bump this whenever the cleaning done in 'read_all_zcta_data' changes, so that
+# cleaned data cached by an earlier version is rebuilt rather than reused.
+CLEANING_VERSION = 2
+
+# Bump this whenever what 'parse_zcta_data' returns changes, so that the data
+# of each commit cached by an earlier version is read again rather than
+# reused (and everything cleaned from it rebuilt).
+PARSING_VERSION = 2
+
+# The renaming of the (upper-cased) columns of the zcta data files to those
+# of the most recent data-by-modzcta.csv
+zcta_column_renames = {'POSITIVE': 'COVID_CASE_COUNT', 
+                       'ZCTA_CUM.PERC_POS': 'PERCENT_POSITIVE',
+                       'MODZCTA_CUM_PERC_POS': 'PERCENT_POSITIVE',
+                       'MODZCTA': 'MODIFIED_ZCTA'}
+
+# The dtypes of the columns of each layout of the zcta data files, by
+# (renamed) column name. Other columns have their dtype inferred. The ZCTA is
+# a float because of the row of totals, which has none.
+zcta_data_schemas = {
+    'tests-by-zcta.csv': {'MODIFIED_ZCTA': 'float64',
+                          'COVID_CASE_COUNT': 'int64',
+                          'TOTAL': 'int64',
+                          'PERCENT_POSITIVE': 'float64'},
+    'data-by-modzcta.csv': {'MODIFIED_ZCTA': 'float64',
+                            'NEIGHBORHOOD_NAME': 'object',
+                            'BOROUGH_GROUP': 'object',
+                            'COVID_CASE_COUNT': 'int64',
+                            'COVID_CASE_RATE': 'float64',
+                            'POP_DENOMINATOR': 'float64',
+                            'COVID_DEATH_COUNT': 'int64',
+                            'COVID_DEATH_RATE': 'float64',
+                            'PERCENT_POSITIVE': 'float64'}
+    }
+
+def read_all_zcta_data(data_dir = '../coronavirus-data/', cache_dir = None, workers = None):
     '''
     Read all the historical zcta data
 
@@ -25,6 +69,23 @@ def read_all_zcta_data(data_dir = '../coronavirus-data/'):
     data_dir : str, optional
         Folderpath to the coronavirus-data repository. The default is 
         '../coronavirus-data/'.
+    cache_dir : str, optional
+        Folderpath in which to cache the data between runs. The data read from
+        each commit is kept there, so that later runs only read new commits,
+        as is the cleaned data, which is reused as is when the repository has
+        no new commits. Otherwise only the dates whose data comes from new
+        commits are cleaned (see 'clean_zcta_data') and added to it. See also
+        'clear_zcta_data_cache'. The default is None, in which case nothing
+        is cached.
+    workers : int, optional
+        The number of threads parsing the files read from the repository
+        (see 'read_zcta_data_of_commits'). The default is None, in which case
+        the default of concurrent.futures.ThreadPoolExecutor is used.
+
+    Raises
+    ------
+    ValueError
+        If the repository has no commits with zcta data.
 
     Returns
     -------
@@ -33,79 +94,521 @@ def read_all_zcta_data(data_dir = '../coronavirus-data/'):
         when the data was created.
 
     '''
+    # If nothing has changed since the cleaned data was cached, use it
+    previous = None
+    if cache_dir is not None:
+        with instrumentation.timer('ingest.cache_check'):
+            head = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=data_dir, capture_output=True, check=True, universal_newlines=True).stdout.strip()
+            manifest = _read_cache_manifest(cache_dir)
+            cleaned_file = os.path.join(cache_dir, 'cleaned.pkl')
+            if _cache_is_current(manifest) and os.path.exists(cleaned_file):
+                previous = pd.read_pickle(cleaned_file)
+                if manifest.get('head') == head:
+                    instrumentation.count('ingest.cleaned_cache_hits')
+                    return previous
+    
     # Access the coronavirus-data repo
+    from git import Repo
     repo = Repo(data_dir)
     
-    # Get information about the commits
-    commit_history = pd.DataFrame({'GIT_COMMIT': repo.iter_commits()})
-    commit_history['COMMIT'] = commit_history['GIT_COMMIT'].astype(str)
+    # Get information about the commits, with the date of their data
+    with instrumentation.timer('ingest.commit_history'):
+        commit_history = read_commit_history(repo)
+    instrumentation.count('ingest.commits_scanned', len(commit_history))
+    
+    commit_history = select_data_commits(commit_history)
+    commits = dict(zip(commit_history['DATA_DATE'].dt.strftime('%Y-%m-%d'), commit_history['COMMIT']))
+    
+    # With cleaned data cached, only read the dates whose commit has changed,
+    # unless some of its dates are gone
+    if previous is not None:
+        cached_commits = manifest.get('commits')
+        if cached_commits is not None and set(cached_commits) <= set(commits):
+            changed = [cached_commits.get(date) != commit for date, commit in commits.items()]
+            commit_history = commit_history[changed]
+            dates = commit_history['DATA_DATE'].to_numpy()
+            previous = previous[~previous.index.get_level_values(1).isin(dates)]
+            instrumentation.count('ingest.incremental_dates', len(commit_history))
+        else:
+            previous = None
+    
+    with instrumentation.timer('ingest.read_commits'):
+        if len(commit_history):
+            data = concat_zcta_data(read_zcta_data_of_commits(repo, commit_history, cache_dir, workers))
+    
+    # Final Data
+    with instrumentation.timer('ingest.clean'):
+        if len(commit_history):
+            data = clean_zcta_data(data, previous)
+        elif previous is not None:
+            data = previous
+        else:
+            raise ValueError("No commits with zcta data were found in " + data_dir)
+    
+    if cache_dir is not None:
+        with instrumentation.timer('ingest.write_cache'):
+            _write_pickle(data, cleaned_file)
+            _write_cache_manifest(cache_dir, dict(_cache_versions(), head=head, commits=commits))
+        
+    return data
+
+# The fixes applied to the data read from all the commits by
+# 'clean_zcta_data', in order. Each rule has a kind, the fields it involves
+# and, for some kinds, values:
+#   'backfill_latest' : set the fields of every record to those of the most
+#       recent record of its ZCTA where none of them are null
+#   'backfill_constant' : the same, for fields which must never change
+#   'fill_per_100k' : fill in the missing values of the first field with
+#       100000 times the second field divided by POP_DENOMINATOR
+#   'drop_match' : drop the records whose fields equal the values
+#   'drop_date' : drop the records of the dates in the values
+# Backfilled fields are moved to the end of the columns.
+CleaningRule = namedtuple('CleaningRule', ['kind', 'fields', 'values'])
+zcta_cleaning_rules = [
+    # Many of the older records have a null NEIGHBORHOOD_NAME and
+    # BOROUGH_GROUP. Fill in the old data with the newer data.
+    CleaningRule('backfill_latest', ['NEIGHBORHOOD_NAME', 'BOROUGH_GROUP'], None),
+    # The POP_DENOMINATOR field is null for the older data. It is the same
+    # for all csvs which contain it.
+    CleaningRule('backfill_constant', ['POP_DENOMINATOR'], None),
+    # The COVID_CASE_RATE field is NaN for the older data, too
+    CleaningRule('fill_per_100k', ['COVID_CASE_RATE', 'COVID_CASE_COUNT'], None),
+    # Two dates have an extra 99999 ZCTA
+    CleaningRule('drop_match', ['MODIFIED_ZCTA'], [99999]),
+    # 2020-04-10 has extra copy of previous day's data for ZCTA 11697
+    CleaningRule('drop_match', ['DATA_DATE', 'MODIFIED_ZCTA', 'COVID_CASE_COUNT'], ['2020-04-10', 11697, 52]),
+    # Drop data on 2020-04-26
+    CleaningRule('drop_date', ['DATA_DATE'], ['2020-04-26']),
+    ]
+
+def clean_zcta_data(data, previous = None, rules = None):
+    '''
+    Clean the data read from all the commits: fill in the fields missing from
+    the older data, drop known bad records and index the data by ZCTA and
+    date.
+    
+    The rules are applied to the columns as arrays, in a single pass: records
+    are dropped with one mask and backfilled values are looked up by ZCTA,
+    so that the whole data is only copied once, when the result is made.
+    
+    With 'previous', only the new data is cleaned, and appended to the
+    previously cleaned data. Its backfilled fields are taken as the values of
+    the last record of each ZCTA, and are only updated (for all the records
+    of a ZCTA) when the new data has more recent ones.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The concatenated data returned by 'read_zcta_data_from_git' for each
+        commit.
+    previous : pandas.DataFrame, optional
+        Data cleaned earlier, which has none of the dates of 'data'. The 
+        default is None.
+    rules : list, optional
+        The CleaningRules to apply. The default is None, in which case
+        'zcta_cleaning_rules' are applied.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The cleaned data, as returned by 'read_all_zcta_data'.
+
+    '''
+    if rules is None:
+        rules = zcta_cleaning_rules
+    columns = {column: data[column].to_numpy() for column in data}
+    order = list(data.columns)
+    # Fields only found in data that is not there yet, e.g. in the older data
+    for rule in rules:
+        for field in rule.fields:
+            if field not in columns:
+                columns[field] = np.full(len(data), np.nan)
+                order.append(field)
+    # The columns only found in the previous data come after those of the new
+    # data, as they would had all of it been cleaned at once
+    if previous is not None:
+        order += [column for column in previous.columns if column not in order]
+    zctas = columns['MODIFIED_ZCTA'].astype(float)
+    dates = columns['DATA_DATE']
+    keep = np.ones(len(data), dtype=bool)
+    if previous is not None:
+        # The last record of each ZCTA of the previously cleaned data
+        codes = previous.index.codes[0]
+        last = np.flatnonzero(_is_last_of_run(codes))
+        previous_zctas = previous.index.levels[0][codes[last]].to_numpy(dtype=float)
+        previous_dates = previous.index.get_level_values(1)[last].to_numpy()
+    
+    for rule in rules:
+        if rule.kind in ('backfill_latest', 'backfill_constant'):
+            fields = list(rule.fields)
+            order = [column for column in order if column not in fields] + fields
+            sources = keep & ~np.isnan(zctas) & ~pd.isnull(dates)
+            for field in fields:
+                sources &= ~pd.isnull(columns[field])
+            source_zctas = zctas[sources]
+            source_dates = dates[sources]
+            source_values = {field: columns[field][sources] for field in fields}
+            if previous is not None:
+                previous_values = {field: previous[field].to_numpy()[last] for field in fields}
+                known = np.ones(len(last), dtype=bool)
+                for field in fields:
+                    known &= ~pd.isnull(previous_values[field])
+                source_zctas = np.concatenate([previous_zctas[known], source_zctas])
+                source_dates = np.concatenate([previous_dates[known], source_dates])
+                source_values = {field: _concatenate_values(previous_values[field][known], source_values[field]) for field in fields}
+            # The most recent source of each ZCTA
+            latest = np.lexsort((source_dates, source_zctas))
+            latest = latest[_is_last_of_run(source_zctas[latest])]
+            latest_zctas = source_zctas[latest]
+            if rule.kind == 'backfill_constant':
+                for field in fields:
+                    looked_up = _lookup_by_zcta(latest_zctas, source_values[field][latest], source_zctas)
+                    if (looked_up != source_values[field]).any():
+                        raise ValueError('%s differs between records of the same ZCTA'%(field))
+            for field in fields:
+                columns[field] = _lookup_by_zcta(latest_zctas, source_values[field][latest], zctas)
+            if previous is not None:
+                changed = np.zeros(len(last), dtype=bool)
+                for field in fields:
+                    looked_up = _lookup_by_zcta(latest_zctas, source_values[field][latest], previous_zctas)
+                    changed |= ~((looked_up == previous_values[field]) | (pd.isnull(looked_up) & pd.isnull(previous_values[field])))
+                if changed.any():
+                    # Only copy the previous data if one of its ZCTAs changed
+                    previous = previous.copy()
+                    previous_all_zctas = previous.index.get_level_values(0).to_numpy(dtype=float)
+                    for field in fields:
+                        previous[field] = _lookup_by_zcta(latest_zctas, source_values[field][latest], previous_all_zctas)
+        elif rule.kind == 'fill_per_100k':
+            field, count_field = rule.fields
+            missing = pd.isnull(columns[field])
+            if missing.any():
+                columns[field] = np.where(missing, 100000 * columns[count_field] / columns['POP_DENOMINATOR'], columns[field])
+            # The previous data may have just been backfilled, too
+            if previous is not None and field in previous and 'POP_DENOMINATOR' in previous:
+                missing = previous[field].isnull() & previous['POP_DENOMINATOR'].notnull()
+                if missing.any():
+                    previous = previous.copy()
+                    previous[field] = previous[field].fillna(100000 * previous[count_field] / previous['POP_DENOMINATOR'])
+        elif rule.kind == 'drop_match':
+            match = keep.copy()
+            for field, value in zip(rule.fields, rule.values):
+                if columns[field].dtype.kind == 'M':
+                    value = np.datetime64(pd.Timestamp(value))
+                match &= columns[field] == value
+            keep &= ~match
+        elif rule.kind == 'drop_date':
+            keep &= ~np.isin(columns[rule.fields[0]], pd.to_datetime(rule.values).to_numpy())
+        else:
+            raise ValueError("Unknown cleaning rule: " + rule.kind)
+    
+    # Only keep records with a non-null MODIFIED_ZCTA, ordered by ZCTA and
+    # date
+    rows = np.flatnonzero(keep & ~np.isnan(zctas))
+    rows = rows[np.lexsort((dates[rows], zctas[rows]))]
+    # Move MODIFIED_ZCTA and DATA_DATE to the index
+    index = pd.MultiIndex.from_arrays([zctas[rows].astype(int), dates[rows]], names=['MODIFIED_ZCTA', 'DATA_DATE'])
+    order = [column for column in order if column not in index.names]
+    data = pd.DataFrame({column: columns[column][rows] for column in order if column in columns}, index=index)
+    if previous is not None:
+        data = pd.concat([previous, data]).sort_index()[order]
+    return data
+
+def _is_last_of_run(keys):
+    # Whether each of the (sorted) keys is the last of its run of equal keys
+    return np.append(keys[1:] != keys[:-1], True)[:len(keys)]
+
+def _concatenate_values(*parts):
+    # Like numpy.concatenate, keeping objects (e.g. strings) as objects
+    if any(part.dtype == object for part in parts):
+        return np.concatenate([part.astype(object) for part in parts])
+    return np.concatenate(parts)
+
+def _lookup_by_zcta(source_zctas, source_values, zctas):
+    # The value of each of zctas in source_values, indexed by the (sorted)
+    # source_zctas, or NaN for those not there
+    positions = np.searchsorted(source_zctas, zctas).clip(0, max(len(source_zctas) - 1, 0))
+    found = (source_zctas[positions] == zctas) if len(source_zctas) else np.zeros(len(zctas), dtype=bool)
+    if found.all():
+        return source_values[positions]
+    dtype = source_values.dtype
+    if dtype.kind in 'biu':
+        dtype = np.dtype('float64')
+    values = np.empty(len(zctas), dtype=dtype)
+    values[:] = np.datetime64('NaT') if dtype.kind == 'M' else np.nan
+    values[found] = source_values[positions[found]]
+    return values
+
+def read_zcta_data_of_commits(repo, commit_history, cache_dir = None, workers = None):
+    '''
+    Get formatted versions of the zcta data of several commits.
+    
+    The files are read from git one after the other, since gitpython's
+    'git cat-file' process serves one request at a time, and are parsed by a
+    pool of threads as they come in. The data of each commit is handed over
+    as soon as it and that of the commits before it are ready, so that it can
+    be added to the rest (see 'concat_zcta_data') rather than kept around.
+
+    Parameters
+    ----------
+    repo : git.Repo
+        The git repo from which to retrieve zcta data.
+    
+    commit_history : pandas.DataFrame
+        The commits to read, with columns COMMIT and DATA_DATE (as returned
+        by 'read_commit_history').
+        
+    cache_dir : str, optional
+        Folderpath of a cache of the data of each commit, kept as one pickle
+        per commit and PARSING_VERSION. The default is None, in which case
+        nothing is cached.
+        
+    workers : int, optional
+        The number of threads parsing the files. The default is None, in
+        which case the default of concurrent.futures.ThreadPoolExecutor is
+        used.
+
+    Yields
+    ------
+    pandas.DataFrame
+        The standardized data of each commit, in order.
+
+    '''
+    from concurrent.futures import Future, ThreadPoolExecutor
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for commit, data_date in zip(commit_history['COMMIT'], commit_history['DATA_DATE']):
+            filename = None
+            if cache_dir is not None:
+                filename = _commit_cache_filename(cache_dir, commit)
+            if filename is not None and os.path.exists(filename):
+                frame = pd.read_pickle(filename)
+                frame['DATA_DATE'] = data_date
+                instrumentation.count('ingest.commit_cache_hits')
+                pending.append(Future())
+                pending[-1].set_result(frame)
+            else:
+                blob, path = read_zcta_blob_from_git(repo, commit[:7])
+                pending.append(pool.submit(_parse_zcta_data, blob, data_date, path, filename))
+            # Hand over the data parsed so far, in order
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _parse_zcta_data(blob, data_date, path, filename):
+    # Parse a file, caching the result in filename if there is one
+    with instrumentation.timer('csv.parse'):
+        data = parse_zcta_data(blob, data_date, path)
+    instrumentation.count('csv.rows_parsed', len(data))
+    if filename is not None:
+        _write_pickle(data, filename)
+    return data
+
+def concat_zcta_data(frames):
+    '''
+    Concatenate the data of several commits, like pandas.concat but copying
+    each commit's data into one array per column as it comes in, so that the
+    commits' DataFrames needn't all be kept until the end. The arrays are
+    allocated ahead, doubling in size whenever they are full.
+
+    Parameters
+    ----------
+    frames : iterable
+        The standardized data of each commit, e.g. as yielded by
+        'read_zcta_data_of_commits'.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The rows of all of 'frames', with the columns of all of them (in
+        order of appearance) and a new RangeIndex. The dtype of each column
+        is the one pandas.concat would give it: missing values are NaN, so
+        integer columns missing from some frames become floats.
+
+    '''
+    columns = {}
+    length = 0
+    capacity = 0
+    for i, frame in enumerate(frames):
+        end = length + len(frame)
+        if end > capacity:
+            capacity = max(2*capacity, end)
+            for column, values in columns.items():
+                columns[column] = _resized(values, capacity)
+        # The columns of the frames before this one that it is missing
+        for column in columns:
+            if column not in frame:
+                columns[column] = _fill_missing(columns[column], length, end)
+        for column in frame.columns:
+            part = frame[column].to_numpy()
+            if column not in columns:
+                columns[column] = np.empty(capacity, dtype=part.dtype)
+                if i > 0:
+                    columns[column] = _fill_missing(columns[column], 0, length)
+            values = columns[column]
+            if values.dtype == object or part.dtype == object:
+                dtype = np.dtype(object)
+            else:
+                dtype = np.result_type(values.dtype, part.dtype)
+            if dtype != values.dtype:
+                values = values.astype(dtype)
+            values[length:end] = part
+            columns[column] = values
+        length = end
+    return pd.DataFrame({column: values[:length] for column, values in columns.items()}, columns=list(columns))
+
+def _resized(values, capacity):
+    # A copy of an array with room for 'capacity' values
+    resized = np.empty(capacity, dtype=values.dtype)
+    resized[:len(values)] = values
+    return resized
+
+def _fill_missing(values, start, end):
+    # Set values[start:end] to NaN (NaT for datetimes), making integer
+    # arrays floats like pandas.concat does
+    if values.dtype.kind in 'biu':
+        values = values.astype('float64')
+    values[start:end] = np.datetime64('NaT') if values.dtype.kind == 'M' else np.nan
+    return values
+
+def read_commit_history(repo):
+    '''
+    Get the hash, commit time and message of every commit in the repo, along
+    with the date of the data it contains (as read off of its message).
+    
+    All of this comes from a single 'git log' call rather than loading each
+    commit object, and the dates are parsed all at once.
+
+    Parameters
+    ----------
+    repo : git.Repo
+        The git repo whose commits to read.
+
+    Returns
+    -------
+    commit_history : pandas.DataFrame
+        One row per commit whose message contains a date, with columns
+        COMMIT, COMMIT_FIRST7, MESSAGE, COMMITTED_DATETIME, DATA_DATE_STR
+        and DATA_DATE, in the order given by 'git log'.
+
+    '''
+    # Each commit is a record starting with \x1e whose fields are separated
+    # by \x1f
+    log = repo.git.log(format='%x1e%H%x1f%cI%x1f%B')
+    records = [record.split('\x1f', 2) for record in log.split('\x1e')[1:]]
+    commit_history = pd.DataFrame(records, columns=['COMMIT', 'COMMITTED_ISO', 'MESSAGE'])
     commit_history['COMMIT_FIRST7'] = commit_history['COMMIT'].str[:7]
-    commit_history['MESSAGE'] = commit_history['GIT_COMMIT'].apply(lambda x: x.message)
-    commit_history['COMMITTED_DATETIME'] = commit_history['GIT_COMMIT'].apply(lambda x: x.committed_datetime)
+    commit_history['COMMITTED_DATETIME'] = pd.to_datetime(commit_history['COMMITTED_ISO'], utc=True)
     
     # Only keeping commits that possibly have a date in it
     commit_history = commit_history[commit_history['MESSAGE'].str.contains('[0-9].+[0-9]')]
     
     # Try to extract a date from the commit message
     # TODO: Compare to the commit message to make sure what we got was reasonable
-    commit_history['DATA_DATE_STR'] = commit_history['MESSAGE'].str.extract('([0-9][0-9\./]+[0-9])')[0]
-    commit_history['DATA_DATE_STR'] = commit_history['DATA_DATE_STR'].str.replace('\.', '/')
+    commit_history['DATA_DATE_STR'] = commit_history['MESSAGE'].str.extract('([0-9][0-9\\./]+[0-9])')[0]
+    commit_history['DATA_DATE_STR'] = commit_history['DATA_DATE_STR'].str.replace('.', '/', regex=False)
     
-    # Convert the date into a datetime object
-    commit_history['DATA_DATE'] = commit_history['DATA_DATE_STR'].apply(datestring2020_to_datetime)
+    # Convert the date into a datetime object. The date is MM/DD, possibly
+    # followed by a year; when it isn't, it's the latest such date no more
+    # than a week after the (local) day of the commit
+    date_parts = commit_history['DATA_DATE_STR'].str.split('/', expand=True).reindex(columns=range(3))
+    committed_day = pd.to_datetime(commit_history['COMMITTED_ISO'].str[:10])
+    year = pd.to_numeric(date_parts[2], errors='coerce')
+    year = year.where(year >= 100, year + 2000).fillna(committed_day.dt.year)
+    month = pd.to_numeric(date_parts[0], errors='coerce')
+    day = pd.to_numeric(date_parts[1], errors='coerce')
+    data_date = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}), errors='coerce')
+    too_late = date_parts[2].isnull() & (data_date > committed_day + pd.Timedelta(days=7))
+    year = year.where(~too_late, year - 1)
+    commit_history['DATA_DATE'] = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}), errors='coerce')
     
+    # Commits whose message has digits that aren't a date are skipped
+    commit_history = commit_history[commit_history['DATA_DATE'].notnull()]
+    return commit_history.drop(columns='COMMITTED_ISO')
+
+def select_data_commits(commit_history):
+    '''
+    Choose the commit whose data is used for each date: the most recent one
+    with that date, for the dates where the repository has zcta data.
+
+    Parameters
+    ----------
+    commit_history : pandas.DataFrame
+        The commits, as returned by 'read_commit_history'.
+
+    Returns
+    -------
+    commit_history : pandas.DataFrame
+        One row per date, from the most recently committed.
+
+    '''
     # For each data date, choose the row with the most recent commit
     commit_history = commit_history.sort_values('COMMITTED_DATETIME', ascending=False)
     commit_history = commit_history.drop_duplicates('DATA_DATE')
     
     # Obtain the data from the git repo, only for dates where it exists
-    commit_history = commit_history[commit_history['DATA_DATE'] >= '2020-04-01']
-    commit_history['DATA'] = commit_history.apply(lambda x: read_zcta_data_from_git(repo, x['COMMIT_FIRST7'], x['DATA_DATE']), axis=1)
-    
-    # Final Data
-    data = pd.concat(list(commit_history['DATA']))
-    
-    # Many of the older records have a null NEIGHBORHOOD_NAME and BOROUGH_GROUP.
-    # Fill in the old data with the newer data.
-    zcta_info = data[['MODIFIED_ZCTA', 'NEIGHBORHOOD_NAME', 'BOROUGH_GROUP', 'DATA_DATE']].dropna()
-    # Take the most recent nieghborbhood name and borough group
-    zcta_info = zcta_info.sort_values('DATA_DATE', ascending=False)
-    zcta_info = zcta_info[['MODIFIED_ZCTA', 'NEIGHBORHOOD_NAME', 'BOROUGH_GROUP']].drop_duplicates('MODIFIED_ZCTA')
-    # Remove this fields from the original data
-    data = data[[x for x in data if x not in ['NEIGHBORHOOD_NAME', 'BOROUGH_GROUP']]]
-    # Attach the new values to the data
-    data = pd.merge(left=data, right=zcta_info, how='left')
-    
-    # The POP_DENOMINATOR field is null for the older data
-    # The POP_DENOMINATOR is the same for all csvs which contain it.  Attach
-    # This to the older data.
-    pop_denominator = data[['MODIFIED_ZCTA', 'POP_DENOMINATOR']].drop_duplicates()
-    pop_denominator = pop_denominator[pop_denominator['POP_DENOMINATOR'].notnull()]
-    assert((~pop_denominator['MODIFIED_ZCTA'].duplicated()).all())
-    data = data[[x for x in data if x!='POP_DENOMINATOR']]
-    # Attach POP_DENOMINATOR to all the data
-    data = pd.merge(left=data, right=pop_denominator, on='MODIFIED_ZCTA', how='left')
-    
-    # The COVID_CASE_RATE field is NaN for the older data, too
-    # Compute it and attach it.
-    data['COVID_CASE_RATE'].fillna(100000 * data['COVID_CASE_COUNT'] / data['POP_DENOMINATOR'], inplace=True)
-    
-    # Fine cleaning the data
-    # Two dates have an extra 99999 ZCTA
-    data.drop(data[data['MODIFIED_ZCTA']==99999].index, inplace=True)
-    # 2020-04-10 has extra copy of previous day's data for ZCTA 11697
-    data.drop(data[(data['DATA_DATE']=="2020-04-10") & (data['MODIFIED_ZCTA']==11697) & (data['COVID_CASE_COUNT']==52)].index, inplace=True)
-    # Drop data on 2020-04-26
-    data = data[data['DATA_DATE']!='2020-04-26']
+    return commit_history[commit_history['DATA_DATE'] >= '2020-04-01']
+
+def clear_zcta_data_cache(cache_dir, commits = False):
+    '''
+    Invalidate data cached by 'read_all_zcta_data'.
     
-    # Only keep records with a non-null MODIFIED_ZCTA
-    data.dropna(subset=['MODIFIED_ZCTA'], inplace=True)
-    # Move MODIFIED_ZCTA and DATA_DATE to the index
-    data = data.astype({'MODIFIED_ZCTA' : int})
-    data.set_index(['MODIFIED_ZCTA','DATA_DATE'], inplace=True)
-    data.sort_index(inplace=True)
-        
-    return data
+    This is needed when the way the data is read or cleaned changes without
+    PARSING_VERSION or CLEANING_VERSION being bumped.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folderpath of the cache.
+    commits : bool, optional
+        Whether to also remove the data read from each commit, not just the
+        cleaned data. The data of each commit is kept by PARSING_VERSION, so
+        this is only needed if 'parse_zcta_data' has changed without it
+        being bumped, or to remove the data cached by earlier versions.
+        The default is False.
+
+    Returns
+    -------
+    None.
+
+    '''
+    for filename in ['manifest.json', 'cleaned.pkl']:
+        if os.path.exists(os.path.join(cache_dir, filename)):
+            os.remove(os.path.join(cache_dir, filename))
+    if commits:
+        shutil.rmtree(os.path.join(cache_dir, 'commits'), ignore_errors=True)
+
+def _commit_cache_filename(cache_dir, commit):
+    # Where the data of a commit is cached, by version of 'parse_zcta_data'
+    return os.path.join(cache_dir, 'commits', 'v%s'%(PARSING_VERSION), commit + '.pkl')
+
+def _cache_versions():
+    # The versions recorded in the manifests of caches of cleaned data
+    return {'cleaning_version': CLEANING_VERSION, 'parsing_version': PARSING_VERSION}
+
+def _cache_is_current(manifest):
+    # Whether a manifest is of cleaned data made by these versions
+    return all(manifest.get(key) == version for key, version in _cache_versions().items())
+
+def _read_cache_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json'), 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+def _write_cache_manifest(cache_dir, manifest):
+    filename = os.path.join(cache_dir, 'manifest.json')
+    with open(filename + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(filename + '.tmp', filename)
+
+def _write_pickle(data, filename):
+    # Write to a temporary file first so an interrupted run never leaves a
+    # partial file in the cache
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    data.to_pickle(filename + '.tmp', compression=None)
+    os.replace(filename + '.tmp', filename)
 
 def read_zcta_data_from_git(repo, commit7, data_date):
     '''
@@ -134,30 +637,135 @@ def read_zcta_data_from_git(repo, commit7, data_date):
         Standardized version of the retrieved data.
 
     '''
-    # First try to get data from data-by-modzcta.csv. If it's not there, get
-    # it from tests-by-zcta.csv
-    try:
-        data = pd.read_csv(StringIO(repo.git.show(commit7 + ':./data-by-modzcta.csv')))
-    except GitCommandError:
-        data = pd.read_csv(StringIO(repo.git.show(commit7 + ':./tests-by-zcta.csv')))
-    data.columns = data.columns.str.upper()
-    data = data.rename(columns = {'POSITIVE': 'COVID_CASE_COUNT', 
-                                  'ZCTA_CUM.PERC_POS': 'PERCENT_POSITIVE',
-                                  'MODZCTA_CUM_PERC_POS': 'PERCENT_POSITIVE',
-                                  'MODZCTA': 'MODIFIED_ZCTA'})
+    blob, path = read_zcta_blob_from_git(repo, commit7)
+    return _parse_zcta_data(blob, data_date, path, None)
+
+def read_zcta_blob_from_git(repo, commit7):
+    '''
+    Get the raw contents of the zcta data file of a commit: its
+    data-by-modzcta.csv or, if it doesn't have one, its tests-by-zcta.csv.
+
+    Returns
+    -------
+    blob : bytes
+        The raw contents of the file.
+    path : str
+        The name of the file.
+
+    '''
+    with instrumentation.timer('git.read_blob'):
+        try:
+            path = 'data-by-modzcta.csv'
+            blob = read_blob_from_git(repo, commit7, path)
+        except ValueError:
+            path = 'tests-by-zcta.csv'
+            blob = read_blob_from_git(repo, commit7, path)
+    instrumentation.count('git.blobs_read')
+    instrumentation.count('git.bytes_read', len(blob))
+    return blob, path
+
+def parse_zcta_data(blob, data_date, path = 'data-by-modzcta.csv'):
+    '''
+    Get formatted version of the contents of a zcta data file (see
+    'read_zcta_data_from_git').
+    
+    The columns listed in the file's schema (see 'zcta_data_schemas') are
+    given their declared dtype, unless their values don't fit it (e.g. an
+    integer column with missing values), in which case they keep the one
+    pandas infers. Other columns always keep the inferred dtype.
+
+    Parameters
+    ----------
+    blob : bytes
+        The raw contents of data-by-modzcta.csv or tests-by-zcta.csv.
+        
+    data_date : pandas.Timestamp
+        Date of the data.
+        
+    path : str, optional
+        The name of the file, which determines its schema. The default is
+        'data-by-modzcta.csv'.
+
+    Returns
+    -------
+    data : pandas.DataFrame.
+        Standardized version of the data.
+
+    '''
+    data = pd.read_csv(BytesIO(blob))
+    data.columns = [zcta_column_renames.get(column.upper(), column.upper()) for column in data.columns]
+    
+    # Give the columns of the schema their declared dtype (rather than
+    # declaring them to read_csv, which is slower for files this small: see
+    # the csv_read_inferred_dtypes and csv_read_declared_dtypes stages of
+    # benchmarks/bench_pipeline.py)
+    for column, dtype in zcta_data_schemas.get(path, {}).items():
+        if column in data and data[column].dtype != dtype:
+            try:
+                values = data[column].astype(dtype)
+            except (ValueError, TypeError):
+                values = None
+            # Keep the inferred dtype if the values don't fit, e.g. an
+            # integer column with missing or fractional values
+            if values is None or (values.dtype.kind in 'iu' and not (values == data[column]).all()):
+                instrumentation.count('csv.schema_mismatches')
+            else:
+                data[column] = values
     
     # The new data doesn't have a TOTAL column.  Create this column when it
-    # doesn't exist
+    # doesn't exist. It is rounded half to even, like round(), and is an
+    # integer column unless some totals are missing.
     if 'TOTAL' not in data:
-        data['TOTAL'] = (100*data['COVID_CASE_COUNT']/data['PERCENT_POSITIVE']).apply(lambda x: round(x) if pd.notnull(x) else x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total = np.round(100*data['COVID_CASE_COUNT'].to_numpy(dtype=float)/data['PERCENT_POSITIVE'].to_numpy(dtype=float))
+        if len(total) and np.isfinite(total).all():
+            total = total.astype('int64')
+        data['TOTAL'] = total
         
     data['DATA_DATE'] = data_date
     return data
     
+def read_blob_from_git(repo, commit, path):
+    '''
+    Get the contents of a file as of some commit.
+    
+    Rather than starting a new git process for each file, this goes through
+    the single long-lived 'git cat-file --batch' process that gitpython keeps
+    for the repo, so reading the whole history costs one process spawn.
+    This is not threadsafe: use one git.Repo per thread.
+
+    Parameters
+    ----------
+    repo : git.Repo
+        The git repo from which to retrieve the file.
+    
+    commit : str
+        Hash (or the start of it) of the commit from which to retrieve the
+        file.
+        
+    path : str
+        Path of the file from the root of the repo.
+
+    Raises
+    ------
+    ValueError
+        If the file does not exist in that commit.
+
+    Returns
+    -------
+    bytes
+        The raw contents of the file.
+
+    '''
+    return repo.git.get_object_data(commit + ':' + path)[3]
+    
 def datestring2020_to_datetime(x):
     '''
     Convert a string of the form MM/DD into a datetime object assuming that
     the year is 2020
+    
+    No longer used by 'read_all_zcta_data', which handles other years (see
+    'read_commit_history').
     '''
     date = datetime.datetime.strptime(x, '%m/%d')
     date = datetime.datetime(2020, date.month, date.day)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Functions for computing metrics derived from the NYC Covid-19 data: day-to-day
+differences, simple and exponential moving averages, growth over a number of
+days (e.g. week-over-week) and rates per 100k people.
+
+The computations are done on the (ZCTA × date) arrays of 'zcta_arrays', for
+all the requested fields and every ZCTA at once, on a daily calendar: dates
+with no data are present as NaN, so that e.g. a difference is never taken
+across a missing day. Results can be extended to newly added days without
+recomputing the whole history.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+import zcta_arrays
+
+def to_daily_calendar(arrays, start=None, end=None):
+    r'''
+    Reindex arrays onto every day from their first to their last date.
+
+    Parameters
+    ----------
+    arrays : zcta_arrays.ZCTAArrays
+        The data in columnar form.
+    start : pandas.Timestamp (or str), optional
+        The first day of the calendar.
+        The default is None. The first date of 'arrays' is then used.
+    end : pandas.Timestamp (or str), optional
+        The last day of the calendar.
+        The default is None. The last date of 'arrays' is then used.
+
+    Returns
+    -------
+    zcta_arrays.ZCTAArrays
+        The same data with a date for every day, those without data being
+        filled with NaN.
+
+    '''
+    calendar = pd.date_range(arrays.dates[0] if start is None else start, arrays.dates[-1] if end is None else end, freq='D')
+    calendar = np.asarray(calendar, dtype='datetime64[ns]')
+    if len(calendar) == len(arrays.dates) and (calendar == arrays.dates).all():
+        return arrays
+    keep = np.isin(arrays.dates, calendar)
+    positions = np.searchsorted(calendar, arrays.dates[keep])
+    metrics = {}
+    for field, values in arrays.metrics.items():
+        metrics[field] = np.full((len(arrays.zctas), len(calendar)), np.nan, dtype=values.dtype, order='F')
+        metrics[field][:, positions] = values[:, keep]
+    return zcta_arrays.ZCTAArrays(arrays.zctas, calendar, metrics, arrays.zcta_info)
+
+def diff(values, periods=1):
+    r'''
+    Difference of each value with the one 'periods' days before it, along
+    the last axis. The first 'periods' days are NaN.
+    '''
+    result = np.full_like(values, np.nan, dtype=float)
+    result[..., periods:] = values[..., periods:] - values[..., :-periods]
+    return result
+
+def sma(values, window):
+    r'''
+    Simple moving average over 'window' days along the last axis. Averages
+    over a window with a missing (NaN) day are NaN, as are the first
+    'window' - 1 days.
+    '''
+    result = np.full_like(values, np.nan, dtype=float)
+    if window > values.shape[-1]:
+        return result
+    total = np.zeros_like(values[..., window - 1:], dtype=float)
+    for k in range(window):
+        total += values[..., k:values.shape[-1] - window + 1 + k]
+    result[..., window - 1:] = total / window
+    return result
+
+def ema(values, span, initial=None):
+    r'''
+    Exponential moving average along the last axis, with smoothing factor
+    2 / (span + 1), i.e. the recursive form y[t] = a x[t] + (1 - a) y[t-1]
+    (pandas' ewm(span=span, adjust=False)). Missing (NaN) days carry the
+    previous average forward.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values to average, with the dates along the last axis.
+    span : int
+        The span of the average.
+    initial : numpy.ndarray, optional
+        The average as of the day before the first day of 'values', e.g. to
+        continue an earlier computation.
+        The default is None. The average then starts at the first value.
+
+    Returns
+    -------
+    numpy.ndarray
+        The averages.
+
+    '''
+    alpha = 2 / (span + 1)
+    result = np.empty_like(values, dtype=float)
+    previous = np.full(values.shape[:-1], np.nan) if initial is None else np.array(initial, dtype=float)
+    for t in range(values.shape[-1]):
+        current = values[..., t]
+        average = np.where(np.isnan(previous), current, alpha * current + (1 - alpha) * previous)
+        previous = np.where(np.isnan(current), previous, average)
+        result[..., t] = previous
+    return result
+
+def growth(values, periods=7):
+    r'''
+    Relative growth of each value over the 'periods' days before it, along
+    the last axis (e.g. 0.1 for a 10% increase). Growth from 0 is NaN.
+    '''
+    result = np.full_like(values, np.nan, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result[..., periods:] = values[..., periods:] / values[..., :-periods] - 1
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+def derived_metric_names(field, sma_windows=(3,), ema_spans=(), growth_periods=(7,), per_capita=False):
+    r'''
+    The names of the metrics 'compute_derived_metrics' derives from a field.
+    '''
+    names = [field + '_DIFF']
+    for window in sma_windows:
+        names += [field + '_SMA%s'%(window), field + '_DIFF_SMA%s'%(window)]
+    for span in ema_spans:
+        names += [field + '_EMA%s'%(span), field + '_DIFF_EMA%s'%(span)]
+    names += [field + '_GROWTH%s'%(periods) for periods in growth_periods]
+    if per_capita:
+        names += [field + '_PER_100K']
+    return names
+
+def lookback_days(sma_windows=(3,), growth_periods=(7,)):
+    r'''
+    The number of days of data before a date that 'compute_derived_metrics'
+    needs to compute the differences, simple moving averages and growth of
+    that date. Exponential moving averages depend on the whole history.
+    '''
+    return max(list(sma_windows) + list(growth_periods) + [0]) + 1
+
+def compute_derived_metrics(arrays, fields=None, sma_windows=(3,), ema_spans=(), growth_periods=(7,), per_capita=False, previous=None):
+    r'''
+    Compute metrics derived from some fields, for every ZCTA and date at once.
+
+    For each field FIELD, the following metrics are added:
+        FIELD_DIFF : the day-to-day difference
+        FIELD_SMAn, FIELD_DIFF_SMAn : the n-day simple moving average of the
+            field and of its difference, for each n in 'sma_windows'
+        FIELD_EMAn, FIELD_DIFF_EMAn : the exponential moving average with
+            span n of the field and of its difference (see 'ema'), for each
+            n in 'ema_spans'
+        FIELD_GROWTHn : the growth over n days (see 'growth'), for each n in
+            'growth_periods'
+        FIELD_PER_100K : the field per 100k people, if 'per_capita' is True
+
+    Parameters
+    ----------
+    arrays : zcta_arrays.ZCTAArrays
+        The data in columnar form.
+    fields : list, optional
+        The fields from which to derive metrics.
+        The default is None. All the metrics of 'arrays' are then used.
+    sma_windows : listable, optional
+        The windows of the simple moving averages.
+        The default is (3,).
+    ema_spans : listable, optional
+        The spans of the exponential moving averages.
+        The default is ().
+    growth_periods : listable, optional
+        The numbers of days over which to compute growth.
+        The default is (7,). The week-over-week growth.
+    per_capita : boolean, optional
+        Whether to compute the fields per 100k people, from the
+        POP_DENOMINATOR in 'arrays.zcta_info'.
+        The default is False.
+    previous : zcta_arrays.ZCTAArrays, optional
+        The result of an earlier call with the same parameters on an older
+        version of the data (i.e. with fewer dates). Only the dates after
+        those of 'previous' are then computed; earlier dates are assumed
+        unchanged.
+        The default is None. Everything is then computed.
+
+    Returns
+    -------
+    zcta_arrays.ZCTAArrays
+        The data on a daily calendar (see 'to_daily_calendar') with the
+        derived metrics added.
+
+    '''
+    if fields is None:
+        fields = list(arrays.metrics)
+
+    # Only the new dates need computing, but they need some earlier ones
+    if previous is not None and np.array_equal(previous.zctas, arrays.zctas) and arrays.dates[-1] > previous.dates[-1]:
+        last_date = previous.dates[-1]
+        window = to_daily_calendar(arrays, start=last_date - np.timedelta64(lookback_days(sma_windows, growth_periods), 'D'))
+        new = window.dates > last_date
+        initial_emas = {name: previous.metrics[name][:, -1] for name in previous.metrics if '_EMA' in name}
+        result = _compute_derived_metrics(window, fields, sma_windows, ema_spans, growth_periods, per_capita, initial_emas, np.argmax(new))
+        metrics = {name: np.concatenate([previous.metrics[name], values[:, new]], axis=1) for name, values in result.metrics.items()}
+        return zcta_arrays.ZCTAArrays(arrays.zctas, np.concatenate([previous.dates, window.dates[new]]), metrics, arrays.zcta_info)
+    elif previous is not None and np.array_equal(previous.zctas, arrays.zctas) and arrays.dates[-1] == previous.dates[-1]:
+        return previous
+
+    return _compute_derived_metrics(to_daily_calendar(arrays), fields, sma_windows, ema_spans, growth_periods, per_capita, {}, 0)
+
+def _compute_derived_metrics(arrays, fields, sma_windows, ema_spans, growth_periods, per_capita, initial_emas, ema_start):
+    # Stack the fields into one (n_fields, n_zcta, n_dates) array, so each
+    # computation is done for all of them at once
+    values = np.stack([np.asarray(arrays.metrics[field], dtype=float) for field in fields])
+    dtype = np.result_type(*[arrays.metrics[field].dtype for field in fields])
+    derived = {'_DIFF': diff(values)}
+    for window in sma_windows:
+        derived['_SMA%s'%(window)] = sma(values, window)
+        derived['_DIFF_SMA%s'%(window)] = sma(derived['_DIFF'], window)
+    for span in ema_spans:
+        for suffix, source in [('_EMA%s'%(span), values), ('_DIFF_EMA%s'%(span), derived['_DIFF'])]:
+            # Exponential moving averages continue from 'initial_emas' as of
+            # the day before 'ema_start'
+            initial = np.stack([initial_emas[field + suffix] for field in fields]) if initial_emas else None
+            derived[suffix] = np.full_like(values, np.nan)
+            derived[suffix][..., ema_start:] = ema(source[..., ema_start:], span, initial)
+    for periods in growth_periods:
+        derived['_GROWTH%s'%(periods)] = growth(values, periods)
+    if per_capita:
+        population = arrays.zcta_info['POP_DENOMINATOR'].reindex(arrays.zctas).to_numpy(dtype=float)
+        derived['_PER_100K'] = 100000 * values / population[:, np.newaxis]
+
+    metrics = dict(arrays.metrics)
+    for i, field in enumerate(fields):
+        for suffix, result in derived.items():
+            metrics[field + suffix] = result[i].astype(dtype, order='F')
+    return zcta_arrays.ZCTAArrays(arrays.zctas, arrays.dates, metrics, arrays.zcta_info)
+
+def add_derived_metrics(data, fields, **kwargs):
+    r'''
+    Add metrics derived from some fields as new columns of a DataFrame.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 are pandas.Timestamp's representing the dates of the
+        data, e.g. as returned by 'clean_data.read_all_zcta_data'.
+    fields : list
+        The fields from which to derive metrics.
+    **kwargs
+        The other parameters of 'compute_derived_metrics' (other than
+        'previous').
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        'data' with a column added for each derived metric.
+
+    '''
+    arrays = zcta_arrays.zcta_arrays_from_dataframe(data[fields], dtype='float64')
+    if kwargs.get('per_capita'):
+        arrays = arrays._replace(zcta_info=data[['POP_DENOMINATOR']].dropna().groupby(level=0).last())
+    derived = compute_derived_metrics(arrays, fields, **kwargs)
+    return add_derived_arrays(data, derived, [name for field in fields for name in derived_metric_names(field, **kwargs)])
+
+def add_derived_arrays(data, derived, names):
+    r'''
+    Add metrics already computed by 'compute_derived_metrics' as new columns
+    of a DataFrame.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 are pandas.Timestamp's representing the dates of the
+        data. Its ZCTAs and dates must be among those of 'derived'.
+    derived : zcta_arrays.ZCTAArrays
+        The result of 'compute_derived_metrics'.
+    names : list
+        The names of the metrics to add.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        'data' with a column added for each metric.
+
+    '''
+    # Look up the position of each row of 'data' in the derived arrays
+    zcta_positions = np.searchsorted(derived.zctas, data.index.get_level_values(0))
+    date_positions = np.searchsorted(derived.dates, np.asarray(data.index.get_level_values(1), dtype='datetime64[ns]'))
+    data = data.copy()
+    for name in names:
+        data[name] = derived.metrics[name][zcta_positions, date_positions]
+    return data
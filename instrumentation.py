@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Opt-in timers and counters for the stages of reading the NYC Covid-19 data
+and making maps of it, to see where the time of a slow run goes.
+
+Nothing is recorded (and the timers cost next to nothing) unless recording
+has been started, e.g.
+
+    with instrumentation.recording(report_file='report.json') as report:
+        data = clean_data.read_all_zcta_data()
+        svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data)
+
+The report then holds the number of calls, total time and latency
+percentiles of each timer, the value of each counter and, optionally, a
+cProfile summary and the peak memory use (from tracemalloc) of the run.
+
+The names of the timers and counters are of the form 'stage.what', e.g.
+'git.read_blob' or 'svg.bytes_written'.
+
+Progress (such as the date of each svg written) is logged as JSON lines with
+'log_event'.
+
+"""
+
+import sys
+import json
+import time
+import threading
+import contextlib
+import numpy as np
+
+# The current recording, or None when nothing is recorded:
+#   timers : dict from timer name to the list of its durations, in seconds
+#   counters : dict from counter name to its value
+#   start : time.perf_counter() when recording started
+#   profiler : the cProfile.Profile, if profiling
+#   profile_file : where to save the profiler's stats, if anywhere
+#   trace_memory : whether tracemalloc was started by this recording
+_recording = None
+_lock = threading.Lock()
+
+# The recordings of the calls of 'call_recorded' in progress, one per thread,
+# which take the place of the current recording in their thread
+_call_recordings = threading.local()
+
+# Where 'log_event' writes its lines
+log_stream = sys.stdout
+
+# The latency percentiles included in reports
+percentiles = [50, 90, 99]
+
+def enabled():
+    r'''
+    Whether anything is being recorded.
+    '''
+    return _recording is not None
+
+def start(profile=False, trace_memory=False, profile_file=None):
+    r'''
+    Start recording, discarding anything recorded before.
+
+    Parameters
+    ----------
+    profile : boolean, optional
+        Whether to also run cProfile. This slows everything down.
+        The default is False.
+    trace_memory : boolean, optional
+        Whether to also trace memory allocations with tracemalloc, for the
+        peak memory use. This slows everything down.
+        The default is False.
+    profile_file : str, optional
+        A file in which to save the profiler's stats (see pstats), when
+        profiling.
+        The default is None.
+
+    Returns
+    -------
+    None.
+
+    '''
+    global _recording
+    recording = {'timers': {}, 'counters': {}, 'start': time.perf_counter(), 'profiler': None, 'profile_file': profile_file, 'trace_memory': False}
+    if trace_memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            recording['trace_memory'] = True
+        elif hasattr(tracemalloc, 'reset_peak'):
+            # python >= 3.9
+            tracemalloc.reset_peak()
+    if profile:
+        import cProfile
+        recording['profiler'] = cProfile.Profile()
+        recording['profiler'].enable()
+    _recording = recording
+
+def stop():
+    r'''
+    Stop recording.
+
+    Returns
+    -------
+    dict
+        The report of what was recorded (see 'report'), or None if nothing
+        was being recorded.
+
+    '''
+    global _recording
+    if _recording is None:
+        return None
+    if _recording.get('profiler') is not None:
+        _recording['profiler'].disable()
+    result = report()
+    if _recording.get('trace_memory'):
+        import tracemalloc
+        tracemalloc.stop()
+    _recording = None
+    return result
+
+@contextlib.contextmanager
+def recording(profile=False, trace_memory=False, profile_file=None, report_file=None):
+    r'''
+    Record for the duration of a with statement (see 'start').
+
+    Parameters
+    ----------
+    The parameters 'profile', 'trace_memory' and 'profile_file' are the same
+    as those of 'start'.
+    report_file : str, optional
+        A file to write the report to as JSON.
+        The default is None.
+
+    Yields
+    ------
+    dict
+        A dict that is filled with the report at the end of the with
+        statement.
+
+    '''
+    result = {}
+    start(profile, trace_memory, profile_file)
+    try:
+        yield result
+    finally:
+        result.update(stop())
+        if report_file is not None:
+            write_report(result, report_file)
+
+@contextlib.contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+_null_timer = contextlib.nullcontext()
+
+def timer(name):
+    r'''
+    Time the body of a with statement, e.g.
+
+        with instrumentation.timer('git.read_blob'):
+            blob = read_blob_from_git(repo, commit, path)
+
+    Nothing is done unless recording.
+    '''
+    if _current_recording() is None:
+        return _null_timer
+    return _timer(name)
+
+def add_time(name, seconds):
+    r'''
+    Add a duration (in seconds) to a timer, when recording.
+    '''
+    recording = _current_recording()
+    if recording is not None:
+        with _lock:
+            recording['timers'].setdefault(name, []).append(seconds)
+
+def count(name, n=1):
+    r'''
+    Add to a counter, when recording.
+    '''
+    recording = _current_recording()
+    if recording is not None:
+        with _lock:
+            recording['counters'][name] = recording['counters'].get(name, 0) + n
+
+def call_recorded(function, *args, **kwargs):
+    r'''
+    Call a function while recording into a fresh recording, e.g. in a worker
+    process, and return what it recorded so that it can be added to the
+    caller's recording with 'merge'.
+
+    Returns
+    -------
+    timers : dict
+        The durations of each timer.
+    counters : dict
+        The value of each counter.
+
+    '''
+    # The fresh recording only replaces the current one in this thread, so
+    # that calls made at the same time by the threads of a pool each record
+    # their own
+    outer = getattr(_call_recordings, 'recording', None)
+    recording = _call_recordings.recording = {'timers': {}, 'counters': {}}
+    try:
+        function(*args, **kwargs)
+        return recording['timers'], recording['counters']
+    finally:
+        _call_recordings.recording = outer
+
+def _current_recording():
+    # The recording of the call of 'call_recorded' this thread is in, if any,
+    # or else the current recording
+    recording = getattr(_call_recordings, 'recording', None)
+    return _recording if recording is None else recording
+
+def merge(recorded):
+    r'''
+    Add the timers and counters returned by 'call_recorded' to the current
+    recording.
+    '''
+    timers, counters = recorded
+    for name, seconds in timers.items():
+        for duration in seconds:
+            add_time(name, duration)
+    for name, n in counters.items():
+        count(name, n)
+
+def report(top=25):
+    r'''
+    Report what has been recorded so far.
+
+    Parameters
+    ----------
+    top : int, optional
+        The number of functions (by cumulative time) of the profile summary
+        and of allocation sites of the memory summary.
+        The default is 25.
+
+    Returns
+    -------
+    dict
+        With keys
+            elapsed_seconds : the time since recording started
+            timers : for each timer, its count, total_seconds, mean_seconds,
+                max_seconds and a pNN_seconds for each of 'percentiles'
+            counters : the value of each counter
+            profile : when profiling, the 'top' functions by cumulative time
+            memory : when tracing memory, the peak and current traced
+                memory, in bytes, and the 'top' allocation sites
+        or None if nothing is being recorded.
+
+    '''
+    recording = _recording
+    if recording is None:
+        return None
+    with _lock:
+        timers = {name: list(seconds) for name, seconds in recording['timers'].items()}
+        counters = dict(recording['counters'])
+    result = {'elapsed_seconds': time.perf_counter() - recording['start'], 'timers': {}, 'counters': counters}
+    for name, seconds in sorted(timers.items()):
+        seconds = np.array(seconds)
+        result['timers'][name] = {'count': len(seconds), 'total_seconds': seconds.sum(), 'mean_seconds': seconds.mean(), 'max_seconds': seconds.max()}
+        for p, value in zip(percentiles, np.percentile(seconds, percentiles)):
+            result['timers'][name]['p%s_seconds'%(p)] = value
+    if recording.get('profiler') is not None:
+        result['profile'] = _profile_summary(recording['profiler'], top, recording['profile_file'])
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        sites = tracemalloc.take_snapshot().statistics('lineno')[:top]
+        result['memory'] = {'peak_bytes': peak, 'current_bytes': current,
+                            'top': [{'site': str(site.traceback), 'bytes': site.size, 'blocks': site.count} for site in sites]}
+    return result
+
+def _profile_summary(profiler, top, profile_file):
+    import pstats
+    if profile_file is not None:
+        profiler.dump_stats(profile_file)
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:top]
+    return [{'function': '%s:%s(%s)'%function, 'calls': calls, 'total_seconds': total, 'cumulative_seconds': cumulative}
+            for function, (primitive_calls, calls, total, cumulative, callers) in functions]
+
+def write_report(result, filename):
+    r'''
+    Write a report (see 'report') to a file as JSON.
+    '''
+    with open(filename, 'w') as report_file:
+        json.dump(result, report_file, indent=2, default=float)
+
+def log_event(event, **fields):
+    r'''
+    Log an event, e.g. some progress, as a line of JSON on 'log_stream', e.g.
+
+        {"time": "2020-06-21T18:09:12", "event": "svg_written", "date": "2020-06-21"}
+
+    '''
+    line = dict({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'event': event}, **fields)
+    log_stream.write(json.dumps(line, default=str) + '\n')
+    log_stream.flush()
@@ -8,49 +8,122 @@ Created on Mon Jun 22 17:39:15 2020
 This script plots the moving average of the day-to-day difference of Covid
 case rates from the first date for which it makes sense.
 
-The script creates a collection of svg files, one for each day.
+The differences and averages are taken over consecutive days (see
+'derived_metrics'), so a day whose average spans a day without data, e.g.
+after a gap in the history, has no value and its ZCTAs are drawn in light
+gray. (Earlier versions of this script averaged the differences between
+the last days that had data.)
+
+The script creates a collection of svg files, one for each day. Run it with
+--workers N to create them using N processes, and with --report FILE to write
+a JSON report of the time spent in each stage (see 'instrumentation').
+
+Run it with --watch to keep running, checking the coronavirus-data
+repository for new commits every --interval seconds and only making the svgs
+of the dates whose values they change (see 'watcher'). It needs a
+--cache-dir, so that only the new commits are read. Stop it with Ctrl-C; the
+--report then covers the whole time it ran.
+
+Run it with --store DIR to keep the data in an on-disk store partitioned by
+date (see 'zcta_store') and make the svgs --window dates at a time, so that
+memory use doesn't grow with the length of the history.
 """
 
 import os
+import asyncio
+import argparse
 import pandas as pd
 
 import svg_utilities
 import clean_data
+import derived_metrics
+import instrumentation
+import watcher
+import zcta_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot the moving average of the day-to-day difference of Covid case rates.')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes used to create the svg files')
+    parser.add_argument('--report', default=None, help='file to write a JSON report of the time spent in each stage to')
+    parser.add_argument('--profile', action='store_true', help='include a cProfile summary in the report')
+    parser.add_argument('--trace-memory', action='store_true', help='include the peak memory use in the report')
+    parser.add_argument('--watch', action='store_true', help='keep running, only making the svgs changed by new commits')
+    parser.add_argument('--interval', type=float, default=600, help='number of seconds between checks for new commits, with --watch')
+    parser.add_argument('--cache-dir', default=None, help='folder in which to cache the data read from the repository (required with --watch)')
+    parser.add_argument('--store', default=None, help='folder of an on-disk store of the data (see zcta_store), read a window of dates at a time')
+    parser.add_argument('--window', type=int, default=30, help='number of dates per window, with --store')
+    args = parser.parse_args()
+    if args.watch and args.cache_dir is None:
+        parser.error('--watch requires --cache-dir')
+    if args.report is not None:
+        instrumentation.start(profile=args.profile, trace_memory=args.trace_memory)
+
+    #svg_utilities.initalize_template_file(colormap='coolwarm')
+
+    # Set this to a different field to plot that field's moving average of diffs
+    plot_field = 'COVID_CASE_RATE'
+    number_of_days = 3 # Number of days to average
+    pfd = plot_field + '_DIFF_SMA%s'%(number_of_days)
+
+    if args.watch:
+        os.makedirs(pfd, exist_ok=True)
+        frame_watcher = watcher.FrameWatcher('../coronavirus-data/', 
+                                             args.cache_dir, 
+                                             [plot_field], 
+                                             pfd, 
+                                             start_date='2020-05-20', 
+                                             sma_windows=(number_of_days,), 
+                                             legend_title='SMA%s of Change in Covid Case Rate per 100k'%(number_of_days), 
+                                             filename_prefix=pfd + '/NYC', 
+                                             colormap='coolwarm', 
+                                             min_rate=-50, 
+                                             max_rate=50, 
+                                             verbose=True, 
+                                             workers=args.workers)
+        # Watch until interrupted, then write the report as a batch run does
+        try:
+            asyncio.run(watcher.watch(frame_watcher, interval=args.interval))
+        except KeyboardInterrupt:
+            pass
+    else:
+        # Get appropriate date range (starting 2020-05-20)
+        date1 = pd.Timestamp('2020-05-20') #First date that makes sense
+
+        # Get data and clean it a bit more and make into a multiindex. With a
+        # store, go through it a window of dates at a time, along with the days
+        # the moving averages of the window need.
+        if args.store is None:
+            data = clean_data.read_all_zcta_data(cache_dir=args.cache_dir)
+            windows = [(data.index.levels[1][data.index.levels[1] >= date1], data)]
+        else:
+            zcta_store.write_zcta_store(store_dir=args.store, cache_dir=args.cache_dir)
+            windows = zcta_store.iter_zcta_store_windows(args.store, start=date1, dates_per_window=args.window, lookback_days=derived_metrics.lookback_days(sma_windows=(number_of_days,), growth_periods=()))
+
+        # We impose a max_rate threshold below the max and output showing only
+        # a handful of data points are beyond the threshhold
+        max_rate = 50
+        min_rate = -50
+        os.makedirs(pfd, exist_ok=True)
+
+        for date_indices, data in windows:
+            # Compute discrete differences per ZCTA and simple moving average,
+            # over consecutive days
+            data = derived_metrics.add_derived_metrics(data, [plot_field], sma_windows=(number_of_days,), growth_periods=())
+
+            relevant_data = data[data.index.get_level_values(1).isin(date_indices)][pfd]
+            print("There are %s data points above the threshhold; they will be cut off"%(len(relevant_data[relevant_data >= max_rate])))
+
+            # Generate the svgs
+            svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data, 
+                                                                       plot_field=pfd, 
+                                                                       legend_title='SMA%s of Change in Covid Case Rate per 100k'%(number_of_days), 
+                                                                       filename_prefix=pfd + '/NYC', 
+                                                                       colormap='coolwarm', 
+                                                                       dates=date_indices, 
+                                                                       min_rate=min_rate, 
+                                                                       max_rate=max_rate, 
+                                                                       verbose=True,
+                                                                       workers=args.workers)
 
-#svg_utilities.initalize_template_file(colormap='coolwarm')
-
-# Set this to a different field to plot that field's moving average of diffs
-plot_field = 'COVID_CASE_RATE'
-number_of_days = 3 # Number of days to average
-pfdiff = plot_field + '_DIFF'
-pfd = plot_field + '_DIFF_SMA%s'%(number_of_days)
-
-# Get data and clean it a bit more and make into a multiindex
-data = clean_data.read_all_zcta_data()
-
-# Compute discrete differences per ZCTA and simple moving average
-data[pfdiff] = data.groupby('MODIFIED_ZCTA')[plot_field].diff()
-data[pfd] = data.groupby('MODIFIED_ZCTA')[pfdiff].rolling(window=3).mean().droplevel(0)
-
-# Get appropriate date range (starting 2020-05-20)
-date1 = pd.Timestamp('2020-05-20') #First date that makes sense
-date_indices = data.index.levels[1][data.index.levels[1] >= date1]
-
-# We impose a max_rate threshold below the max and output showing only
-# a handful of data points are beyond the threshhold
-max_rate = 50
-min_rate = -50
-relevant_data = data[data.index.get_level_values(1).isin(date_indices)][pfd]
-print("There are %s data points above the threshhold; they will be cut off"%(len(relevant_data[relevant_data >= max_rate])))
-
-# Generate the svgs
-os.makedirs(pfd, exist_ok=True)
-svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data, 
-                                                           plot_field=pfd, 
-                                                           legend_title='SMA%s of Change in Covid Case Rate per 100k'%(number_of_days), 
-                                                           filename_prefix=pfd + '/NYC', 
-                                                           colormap='coolwarm', 
-                                                           dates=date_indices, 
-                                                           min_rate=min_rate, 
-                                                           max_rate=max_rate, 
-                                                           verbose=True)
+    if args.report is not None:
+        instrumentation.write_report(instrumentation.stop(), args.report)
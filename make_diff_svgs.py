@@ -9,47 +9,90 @@ This script plots the day-to-day difference of Covid case rates from the first
 date for which it makes sense (i.e. such that starting at the previous day,
 there is data for each subsequent day.)
 
-The script creates a collection of svg files, one for each day.
+The differences are taken between consecutive days (see 'derived_metrics'),
+so a day whose previous day has no data, e.g. after a gap in the history,
+has no difference and its ZCTAs are drawn in light gray. (Earlier versions
+of this script plotted the difference with the last day that had data.)
+
+The script creates a collection of svg files, one for each day. Run it with
+--workers N to create them using N processes, and with --report FILE to write
+a JSON report of the time spent in each stage (see 'instrumentation'). Give
+it a --cache-dir so that only the commits new since the last run are read.
+
+Run it with --store DIR to keep the data in an on-disk store partitioned by
+date (see 'zcta_store') and make the svgs --window dates at a time, so that
+memory use doesn't grow with the length of the history.
 """
 
 import os
+import argparse
 import pandas as pd
 
 import svg_utilities
 import clean_data
+import derived_metrics
+import instrumentation
+import zcta_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot the day-to-day difference of Covid case rates.')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes used to create the svg files')
+    parser.add_argument('--report', default=None, help='file to write a JSON report of the time spent in each stage to')
+    parser.add_argument('--profile', action='store_true', help='include a cProfile summary in the report')
+    parser.add_argument('--trace-memory', action='store_true', help='include the peak memory use in the report')
+    parser.add_argument('--cache-dir', default=None, help='folder in which to cache the data read from the repository')
+    parser.add_argument('--store', default=None, help='folder of an on-disk store of the data (see zcta_store), read a window of dates at a time')
+    parser.add_argument('--window', type=int, default=30, help='number of dates per window, with --store')
+    args = parser.parse_args()
+    if args.report is not None:
+        instrumentation.start(profile=args.profile, trace_memory=args.trace_memory)
+
+    svg_utilities.initalize_template_file(colormap='coolwarm')
+
+    #Set this to a different field to plot that field's diffs
+    plot_field = 'COVID_CASE_RATE'
+    pfd = plot_field + '_DIFF'
+
+    # Get appropriate date range (starting 2020-05-19)
+    date1 = pd.Timestamp('2020-05-19') #First date that makes sense
+
+    # Get data and clean it a bit more and make into a multiindex. With a
+    # store, go through it a window of dates at a time, along with the day
+    # before each window.
+    if args.store is None:
+        data = clean_data.read_all_zcta_data(cache_dir=args.cache_dir)
+        date0 = data.index.levels[1][0]
+        windows = [(data.index.levels[1][data.index.levels[1] >= date1], data)]
+    else:
+        zcta_store.write_zcta_store(store_dir=args.store, cache_dir=args.cache_dir)
+        date0 = zcta_store.zcta_store_dates(args.store)[0]
+        windows = zcta_store.iter_zcta_store_windows(args.store, start=date1, dates_per_window=args.window, lookback_days=derived_metrics.lookback_days(sma_windows=(), growth_periods=()))
+    print("Ignore", date0) #first date
+
+    # We impose a max_rate threshold below the max and output showing only
+    # a handful of data points are beyond the threshhold
+    max_rate = 50
+    min_rate = -50
+    # Make folder if it doesn't exist
+    os.makedirs(name=pfd, exist_ok=True)
+
+    for date_indices, data in windows:
+        # Compute discrete differences per ZCTA, between consecutive days
+        data = derived_metrics.add_derived_metrics(data, [plot_field], sma_windows=(), growth_periods=())
+
+        relevant_data = data[data.index.get_level_values(1).isin(date_indices)][pfd]
+        print("There are %s data points above the threshhold; they will be cut off"%(len(relevant_data[relevant_data >= max_rate])))
+
+        # Generate the svgs
+        svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data.drop(index=date0, level=1, errors='ignore'), 
+                                                                   plot_field=pfd, 
+                                                                   legend_title='Change in Covid Case Rate per 100k', 
+                                                                   filename_prefix=pfd + '/NYC', colormap='coolwarm', 
+                                                                   dates=date_indices, 
+                                                                   min_rate=min_rate, 
+                                                                   max_rate=max_rate, 
+                                                                   verbose=True,
+                                                                   workers=args.workers)
 
-svg_utilities.initalize_template_file(colormap='coolwarm')
-
-#Set this to a different field to plot that field's diffs
-plot_field = 'COVID_CASE_RATE'
-pfd = plot_field + '_DIFF'
-
-# Get data and clean it a bit more and make into a multiindex
-data = clean_data.read_all_zcta_data()
-
-# Compute discrete differences per ZCTA
-data[pfd] = data.groupby('MODIFIED_ZCTA')[plot_field].diff()
-
-# Get appropriate date range (starting 2020-05-19)
-date0 = data.index.levels[1][0]; print("Ignore", date0) #first date
-date1 = pd.Timestamp('2020-05-19') #First date that makes sense
-date_indices = data.index.levels[1][data.index.levels[1] >= date1]
-
-# We impose a max_rate threshold below the max and output showing only
-# a handful of data points are beyond the threshhold
-max_rate = 50
-min_rate = -50
-relevant_data = data[data.index.get_level_values(1).isin(date_indices)][pfd]
-print("There are %s data points above the threshhold; they will be cut off"%(len(relevant_data[relevant_data >= max_rate])))
-
-# Generate the svgs
-# Make folder if it doesn't exist
-os.makedirs(name=pfd, exist_ok=True)
-svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data.drop(index=date0, level=1), 
-                                                           plot_field=pfd, 
-                                                           legend_title='Change in Covid Case Rate per 100k', 
-                                                           filename_prefix=pfd + '/NYC', colormap='coolwarm', 
-                                                           dates=date_indices, 
-                                                           min_rate=min_rate, 
-                                                           max_rate=max_rate, 
-                                                           verbose=True)
+    if args.report is not None:
+        instrumentation.write_report(instrumentation.stop(), args.report)
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Functions for extracting the geometry of nychealth's map of NYC (by ZCTA)
+once, into an index from which templates and rasters are made without
+parsing the map again.
+
+The index holds, for each ZCTA of the map (in the order they are drawn),
+the 'd' attribute of its path, its bounding box and its centroid, along
+with the text of the map preceding and following the ZCTAs' paths. It is
+written next to the map, as 'NYCmap06-12_geometry.json.gz', by
+'make_map_geometry_index' (which 'svg_utilities.initalize_template_file'
+runs), and is remade whenever the map is newer than it. Reading the geometry
+never writes anything: without a fresh index, the map is parsed in memory.
+
+"""
+
+import os
+import re
+import gzip
+import json
+from collections import namedtuple
+import numpy as np
+
+# The geometry of a map:
+#   header : the text of the map preceding the first ZCTA's path element
+#   zctas : the ZCTA of each shape, in the order they are drawn
+#   paths : the 'd' attribute of each ZCTA's path
+#   fills : the fill color of each ZCTA's path in the map
+#   bboxes : the bounding box (xmin, ymin, xmax, ymax) of each ZCTA
+#   centroids : the centroid (x, y) of each ZCTA
+#   footer : the text of the map following the last ZCTA's path element
+MapGeometry = namedtuple('MapGeometry', ['header', 'zctas', 'paths', 'fills', 'bboxes', 'centroids', 'footer'])
+
+# A ZCTA's path element in nychealth's map, following its aria-label, with
+# slots for its 'd' attribute and its fill color
+zcta_path_format = 'role="graphics-symbol" aria-roledescription="geoshape" transform="translate(0,0)" d="%s" fill="%s" stroke="#FFFFFF" stroke-width="0.5"></path>'
+
+# The detail levels of simplified maps (see 'simplify_geometry'): the
+# tolerance, in units of the map (pixels of the full size map), within which
+# borders are simplified, and the number of decimals coordinates are rounded
+# to. 'full' is the map as is.
+detail_levels = {
+    'full' : None,
+    'high' : (0.2, 2),
+    'medium' : (0.6, 1),
+    'low' : (1.5, 0)
+    }
+
+# Map geometries already loaded by this process, keyed by map file path
+_map_geometries = {}
+
+# Simplified map geometries already made by this process, keyed by map file
+# path and detail level
+_simplified_geometries = {}
+
+def geometry_filename(map_filename='NYCmap06-12.svg'):
+    r'''
+    The name of the index of the geometry of a map.
+    '''
+    return os.path.splitext(map_filename)[0] + '_geometry.json.gz'
+
+def load_map_geometry(map_filename='NYCmap06-12.svg'):
+    r'''
+    Get the geometry of a map, from its index.
+
+    If the index doesn't exist or is older than the map, the map is parsed
+    with 'extract_map_geometry' instead; no index is written (see
+    'make_map_geometry_index'). The geometry is only read the first time it
+    is needed by this process; afterwards it is kept in memory.
+
+    Parameters
+    ----------
+    map_filename : str, optional
+        The name of nychealth's map file.
+        The default is 'NYCmap06-12.svg'.
+
+    Returns
+    -------
+    MapGeometry
+        The geometry of the map.
+
+    '''
+    map_filename = os.path.abspath(map_filename)
+    if map_filename not in _map_geometries:
+        filename = geometry_filename(map_filename)
+        if _index_is_fresh(map_filename, filename):
+            geometry = read_map_geometry(filename)
+        else:
+            geometry = extract_map_geometry(map_filename)
+        _map_geometries[map_filename] = geometry
+    return _map_geometries[map_filename]
+
+def make_map_geometry_index(map_filename='NYCmap06-12.svg'):
+    r'''
+    Make the index of the geometry of a map (see 'geometry_filename'), if it
+    doesn't exist or is older than the map; once made, the map itself is no
+    longer needed.
+
+    If the index can't be written (e.g. the directory of the map is read
+    only), the geometry is only kept in memory for this process.
+
+    Parameters
+    ----------
+    map_filename : str, optional
+        The name of nychealth's map file.
+        The default is 'NYCmap06-12.svg'.
+
+    Returns
+    -------
+    MapGeometry
+        The geometry of the map.
+
+    '''
+    geometry = load_map_geometry(map_filename)
+    filename = geometry_filename(os.path.abspath(map_filename))
+    if not _index_is_fresh(os.path.abspath(map_filename), filename):
+        try:
+            write_map_geometry(geometry, filename)
+        except OSError:
+            pass
+    return geometry
+
+def _index_is_fresh(map_filename, filename):
+    # Whether the index of a map exists and isn't older than the map
+    return os.path.exists(filename) and (not os.path.exists(map_filename) or os.path.getmtime(filename) >= os.path.getmtime(map_filename))
+
+def load_simplified_geometry(detail='full', map_filename='NYCmap06-12.svg'):
+    r'''
+    Get the geometry of a map at some level of detail.
+
+    The simplified geometry is only made the first time it is needed by this
+    process; afterwards it is kept in memory.
+
+    Parameters
+    ----------
+    detail : str, optional
+        One of the levels of 'detail_levels'.
+        The default is 'full', the map as is.
+    map_filename : str, optional
+        The name of nychealth's map file.
+        The default is 'NYCmap06-12.svg'.
+
+    Returns
+    -------
+    MapGeometry
+        The geometry of the map at that level of detail.
+
+    '''
+    if detail not in detail_levels:
+        raise ValueError("Unknown detail level: %s (not one of %s)"%(detail, ', '.join(detail_levels)))
+    geometry = load_map_geometry(map_filename)
+    if detail_levels[detail] is None:
+        return geometry
+    key = (os.path.abspath(map_filename), detail)
+    if key not in _simplified_geometries:
+        _simplified_geometries[key] = simplify_geometry(geometry, *detail_levels[detail])
+    return _simplified_geometries[key]
+
+def extract_map_geometry(map_filename='NYCmap06-12.svg'):
+    r'''
+    Parse the geometry of nychealth's map.
+
+    Parameters
+    ----------
+    map_filename : str, optional
+        The name of nychealth's map file.
+        The default is 'NYCmap06-12.svg'.
+
+    Returns
+    -------
+    MapGeometry
+        The geometry of the map.
+
+    '''
+    # nychealth's map file is all one line
+    with open(map_filename, 'r') as map_file:
+        LINE = map_file.readline()
+
+    # Break it up into segments based on ZCTA
+    tokens = LINE.split("<path aria-label=")
+    element_re = re.compile(re.escape(zcta_path_format).replace('%s', '([^"]*)'))
+    zctas = []
+    paths = []
+    fills = []
+    footer = None
+    for i, token in enumerate(tokens[1:]):
+        zctas.append(int(re.search(r'ZIP Code: ([0-9]+)', token).group(1)))
+        element = element_re.search(token)
+        if element is None:
+            raise ValueError("Unexpected path element for ZCTA %s in %s"%(zctas[-1], map_filename))
+        paths.append(element.group(1))
+        fills.append(element.group(2))
+        # Only the last segment has more than the path element
+        if i == len(tokens) - 2:
+            footer = token[element.end():]
+        elif element.end() != len(token):
+            raise ValueError("Unexpected text after the path of ZCTA %s in %s"%(zctas[-1], map_filename))
+
+    bboxes = []
+    centroids = []
+    for d in paths:
+        bbox, centroid = path_bbox_and_centroid(d)
+        bboxes.append(bbox)
+        centroids.append(centroid)
+    return MapGeometry(tokens[0], zctas, paths, fills, bboxes, centroids, footer)
+
+def path_rings(d):
+    r'''
+    Split the 'd' attribute of an svg path made only of absolute M, L and Z
+    commands (like those of nychealth's map) into its rings.
+
+    Returns
+    -------
+    list
+        The vertices of each ring, as arrays of shape (n, 2).
+
+    '''
+    return [np.array(re.split(r'[L,]', ring.rstrip('Z')), dtype=float).reshape(-1, 2) for ring in d.split('M')[1:]]
+
+def path_bbox_and_centroid(d):
+    r'''
+    Compute the bounding box and centroid of a path (see 'path_rings').
+
+    The centroid is that of the area enclosed by the path, or the mean of
+    its vertices if it encloses none.
+
+    Returns
+    -------
+    bbox : list
+        The bounding box (xmin, ymin, xmax, ymax) of the path.
+    centroid : list
+        The centroid (x, y) of the path.
+
+    '''
+    rings = path_rings(d)
+    vertices = np.concatenate(rings)
+    bbox = vertices.min(axis=0).tolist() + vertices.max(axis=0).tolist()
+    # The shoelace formula, summed over the rings so that holes (drawn the
+    # other way around) are subtracted
+    area = 0
+    moment = np.zeros(2)
+    for ring in rings:
+        following = np.roll(ring, -1, axis=0)
+        cross = ring[:, 0] * following[:, 1] - following[:, 0] * ring[:, 1]
+        area += cross.sum() / 2
+        moment += ((ring + following) * cross[:, None]).sum(axis=0) / 6
+    if abs(area) > 1e-12:
+        centroid = (moment / area).tolist()
+    else:
+        centroid = vertices.mean(axis=0).tolist()
+    return bbox, centroid
+
+def write_map_geometry(geometry, filename):
+    r'''
+    Write a map's geometry to an index file, as gzipped JSON.
+    '''
+    # Write to a temporary file of this process first, so an interrupted run
+    # never leaves a partial index and processes making the index at the
+    # same time (e.g. the workers of a pool) don't write over each other's
+    temporary_filename = '%s.%s.tmp'%(filename, os.getpid())
+    try:
+        with gzip.open(temporary_filename, 'wt', encoding='utf-8') as outfile:
+            json.dump(geometry._asdict(), outfile, separators=(',', ':'))
+        os.replace(temporary_filename, filename)
+    except OSError:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        # Another process having made the index is as good
+        if not os.path.exists(filename):
+            raise
+
+def read_map_geometry(filename):
+    r'''
+    Read a map's geometry from an index file written by 'write_map_geometry'.
+    '''
+    with gzip.open(filename, 'rt', encoding='utf-8') as infile:
+        return MapGeometry(**json.load(infile))
+
+def simplify_geometry(geometry, tolerance, decimals):
+    r'''
+    Simplify the shapes of a map, those of the ZCTAs as well as the gray
+    shapes drawn beneath them (see 'simplify_paths').
+
+    Parameters
+    ----------
+    geometry : MapGeometry
+        The geometry of the map.
+    tolerance : float
+        The distance, in units of the map, within which borders are
+        simplified.
+    decimals : int
+        The number of decimals the coordinates are rounded to.
+
+    Returns
+    -------
+    MapGeometry
+        The simplified geometry, with the same ZCTAs in the same order.
+
+    '''
+    background_re = re.compile(r'd="([MLZ][^"]*)" fill="lightgray"')
+    background = background_re.findall(geometry.header)
+    paths = simplify_paths(geometry.paths + background, tolerance, decimals)
+    simplified = dict(zip(background, paths[len(geometry.paths):]))
+    header = background_re.sub(lambda match: 'd="%s" fill="lightgray"'%(simplified[match.group(1)]), geometry.header)
+    paths = paths[:len(geometry.paths)]
+    bboxes = []
+    centroids = []
+    for d in paths:
+        bbox, centroid = path_bbox_and_centroid(d)
+        bboxes.append(bbox)
+        centroids.append(centroid)
+    return geometry._replace(header=header, paths=paths, bboxes=bboxes, centroids=centroids)
+
+def simplify_paths(paths, tolerance, decimals):
+    r'''
+    Simplify the outlines of shapes that share borders (see 'path_rings'),
+    keeping their shared borders identical.
+
+    As with TopoJSON, the rings of the shapes are cut into arcs at the
+    vertices where the shapes they border change (e.g. where three shapes
+    meet). Each arc is simplified once, with the Douglas-Peucker algorithm,
+    and the result is used by every ring it is part of, so that neighboring
+    shapes neither overlap nor leave gaps between them. The coordinates are
+    then rounded, and rings left with fewer than three vertices are dropped
+    (unless they're all a shape has).
+
+    Parameters
+    ----------
+    paths : list
+        The 'd' attributes of the shapes' paths.
+    tolerance : float
+        The distance, in units of the paths, within which borders are
+        simplified.
+    decimals : int
+        The number of decimals the coordinates are rounded to.
+
+    Returns
+    -------
+    list
+        The 'd' attribute of each simplified path.
+
+    '''
+    shapes = [[[tuple(vertex) for vertex in ring.tolist()] for ring in path_rings(d)] for d in paths]
+    # The rings each vertex is part of
+    vertex_rings = {}
+    ring_id = 0
+    for rings in shapes:
+        for ring in rings:
+            for vertex in ring:
+                vertex_rings.setdefault(vertex, set()).add(ring_id)
+            ring_id += 1
+    vertex_rings = {vertex: frozenset(ids) for vertex, ids in vertex_rings.items()}
+
+    arcs = {}
+    result = []
+    for rings in shapes:
+        simplified_rings = []
+        for ring in rings:
+            simplified = []
+            for arc in _ring_arcs(ring, vertex_rings):
+                # Shared arcs are simplified once, in the same direction
+                key = min(arc, arc[::-1])
+                if key not in arcs:
+                    arcs[key] = _simplify_arc(key, tolerance)
+                kept = arcs[key] if key == arc else arcs[key][::-1]
+                simplified.extend(kept[:-1])
+            simplified_rings.append(simplified)
+        result.append(_format_path([_round_ring(ring, decimals) for ring in simplified_rings], rings, decimals))
+    return result
+
+def _ring_arcs(ring, vertex_rings):
+    # Cut a ring into arcs, from one break vertex to the next, at the
+    # vertices where the rings bordering it change. Rings without any are
+    # cut at their smallest vertex and the one farthest from it.
+    n = len(ring)
+    sets = [vertex_rings[vertex] for vertex in ring]
+    breaks = [i for i in range(n) if len(sets[i]) > 2 or sets[i] != sets[i - 1] or sets[i] != sets[(i + 1)%n]]
+    if not breaks:
+        first = ring.index(min(ring))
+        distances = np.hypot(*(np.array(ring) - ring[first]).T)
+        breaks = sorted({first, int(distances.argmax())})
+    arcs = []
+    for start, end in zip(breaks, breaks[1:] + [breaks[0] + n]):
+        arcs.append(tuple(ring[i%n] for i in range(start, end + 1)))
+    return arcs
+
+def _simplify_arc(arc, tolerance):
+    # The Douglas-Peucker algorithm, keeping the arc's ends
+    points = np.array(arc)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last <= first + 1:
+            continue
+        start = points[first]
+        direction = points[last] - start
+        offsets = points[first + 1:last] - start
+        length = np.hypot(*direction)
+        if length > 0:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            keep[first + 1 + farthest] = True
+            stack.append((first, first + 1 + farthest))
+            stack.append((first + 1 + farthest, last))
+    return tuple(vertex for vertex, kept in zip(arc, keep) if kept)
+
+def _round_ring(ring, decimals):
+    # Round the coordinates of a ring, dropping the vertices made equal to
+    # the previous one
+    rounded = []
+    for x, y in np.round(np.array(ring, dtype=float).reshape(-1, 2), decimals).tolist():
+        if not rounded or rounded[-1] != (x, y):
+            rounded.append((x, y))
+    while len(rounded) > 1 and rounded[-1] == rounded[0]:
+        rounded.pop()
+    return rounded
+
+def _format_path(rings, original_rings, decimals):
+    # The 'd' attribute of the rings with at least three vertices, or of the
+    # largest original ring if none are left
+    rings = [ring for ring in rings if len(ring) >= 3]
+    if not rings:
+        rings = [_round_ring(max(original_rings, key=len), decimals)]
+    return ''.join('M' + 'L'.join('%s,%s'%(_format_coordinate(x, decimals), _format_coordinate(y, decimals)) for x, y in ring) + 'Z' for ring in rings)
+
+def _format_coordinate(value, decimals):
+    # The shortest text of a rounded coordinate
+    text = '%.*f'%(decimals, value)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+A small local http server that renders maps of the NYC Covid-19 data on
+request, using the templates and colormaps of 'svg_utilities'.
+
+Maps are requested as
+
+    /map.svg?field=COVID_CASE_RATE&date=2020-06-21&colormap=coolwarm&min=-50&max=50&legend=...&detail=low
+
+where every parameter other than 'date' is optional ('min' and 'max' default
+to the smallest and largest values of the field, 'detail' to 'full'; see
+'map_geometry.detail_levels'). The list of fields and
+dates is available at /info. Rendered maps are kept (both as is and gzipped)
+in an LRU cache of bounded size, and are served with an ETag so that clients can revalidate
+them with conditional requests. The templates of colormaps (see
+'svg_utilities.initalize_template_file') are made in memory the first time
+they are requested, without writing any file.
+
+Run it with, e.g.
+
+    python map_server.py --port 8000 --cache-dir zcta_cache
+
+"""
+
+import io
+import json
+import math
+import gzip
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+
+import svg_utilities
+import map_geometry
+
+class FrameCache:
+    r'''
+    A thread-safe LRU cache of rendered maps whose total size is bounded.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The largest total size of the cached values, in bytes. The least
+        recently used values are dropped to stay below it.
+
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame):
+        size = _frame_size(frame)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._frames:
+                self.bytes -= _frame_size(self._frames.pop(key))
+            self._frames[key] = frame
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= _frame_size(self._frames.popitem(last=False)[1])
+
+def _frame_size(frame):
+    # The number of bytes of the bodies of a frame, leaving out its ETag
+    return sum(len(body) for body in frame[:-1])
+
+def render_map(data, field, date, colormap, min_rate, max_rate, legend_title=None, detail='full'):
+    r'''
+    Render the map of one date into memory.
+
+    Returns
+    -------
+    gzipped_body : bytes
+        The gzipped svg.
+    body : bytes
+        The svg.
+    etag : str
+        The (quoted) ETag of the svg.
+
+    '''
+    svg = io.BytesIO()
+    svg_utilities.mi_generate_svg_from_day_dataframe(data.loc[pd.IndexSlice[:, date], :], plot_field=field, legend_title=legend_title, min_rate=min_rate, max_rate=max_rate, colormap=colormap, outfile=svg, detail=detail)
+    svg = svg.getvalue()
+    return gzip.compress(svg, compresslevel=6), svg, '"%s"'%(hashlib.sha1(svg).hexdigest())
+
+def make_handler(data, cache, default_colormap='rainbow'):
+    r'''
+    Make the request handler class of a server for some data.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data to plot, e.g. as returned by 'clean_data.read_all_zcta_data'.
+    cache : FrameCache
+        The cache of rendered maps.
+    default_colormap : str, optional
+        The colormap used when none is requested.
+        The default is 'rainbow'.
+
+    Returns
+    -------
+    class
+        A subclass of http.server.BaseHTTPRequestHandler.
+
+    '''
+    fields = [field for field in data.columns if pd.api.types.is_numeric_dtype(data[field])]
+    dates = data.index.levels[1]
+    colormaps = set(svg_utilities.colormap_names())
+    ranges = {}
+    template_lock = threading.Lock()
+
+    class MapRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == '/info':
+                info = {'fields': fields, 'dates': [date.strftime('%Y-%m-%d') for date in dates], 'colormaps': sorted(colormaps), 'details': list(map_geometry.detail_levels)}
+                return self._send(200, json.dumps(info).encode('utf-8'), 'application/json')
+            if url.path != '/map.svg':
+                return self._send(404, b'Not found', 'text/plain')
+
+            # Check the parameters before they get anywhere near the renderer
+            field = query.get('field', 'COVID_CASE_RATE')
+            colormap = query.get('colormap', default_colormap)
+            detail = query.get('detail', 'full')
+            try:
+                date = pd.Timestamp(query['date'])
+                min_rate = float(query['min']) if 'min' in query else None
+                max_rate = float(query['max']) if 'max' in query else None
+            except (KeyError, ValueError):
+                return self._send(400, b'A valid date, min and max are needed', 'text/plain')
+            if field not in fields or date not in dates or colormap not in colormaps or detail not in map_geometry.detail_levels:
+                return self._send(404, b'Unknown field, date, colormap or detail', 'text/plain')
+            if field not in ranges:
+                ranges[field] = (data[field].min(), data[field].max())
+            min_rate = ranges[field][0] if min_rate is None else min_rate
+            max_rate = ranges[field][1] if max_rate is None else max_rate
+            # float() accepts 'nan' and 'inf', which the colormap can't scale
+            if not (math.isfinite(min_rate) and math.isfinite(max_rate) and min_rate < max_rate):
+                return self._send(400, b'min and max must be finite, with min below max', 'text/plain')
+            legend_title = query.get('legend')
+
+            key = (field, date, colormap, min_rate, max_rate, legend_title, detail)
+            frame = cache.get(key)
+            if frame is None:
+                with template_lock:
+                    try:
+                        svg_utilities.load_compiled_template(colormap, detail)
+                    except FileNotFoundError:
+                        svg_utilities.initalize_template_file(colormap=colormap, details=[detail], in_memory=True)
+                frame = render_map(data, field, date, colormap, min_rate, max_rate, legend_title, detail)
+                cache.put(key, frame)
+            gzipped_body, body, etag = frame
+
+            if _etag_matches(self.headers.get('If-None-Match', ''), etag):
+                return self._send(304, b'', None, etag)
+            if _accepts_gzip(self.headers.get('Accept-Encoding', '')):
+                return self._send(200, gzipped_body, 'image/svg+xml', etag, gzipped=True)
+            return self._send(200, body, 'image/svg+xml', etag)
+
+        def _send(self, status, body, content_type, etag=None, gzipped=False):
+            self.send_response(status)
+            if content_type is not None:
+                self.send_header('Content-Type', content_type)
+            if etag is not None:
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Vary', 'Accept-Encoding')
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if status != 304:
+                self.wfile.write(body)
+
+    return MapRequestHandler
+
+def _etag_matches(if_none_match, etag):
+    # Whether an If-None-Match header matches an ETag, with the weak
+    # comparison of RFC 9110 (W/"x" matches "x") and '*' matching any
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+def _accepts_gzip(accept_encoding):
+    # Whether an Accept-Encoding header allows gzip, i.e. gives it (or '*',
+    # if it isn't listed) a q-value above 0, as in RFC 9110
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *parameters = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+def serve(data, host='127.0.0.1', port=8000, cache_bytes=256 * 2**20, default_colormap='rainbow'):
+    r'''
+    Serve maps of some data until interrupted.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data to plot, e.g. as returned by 'clean_data.read_all_zcta_data'.
+    host : str, optional
+        The address to listen on.
+        The default is '127.0.0.1'.
+    port : int, optional
+        The port to listen on.
+        The default is 8000.
+    cache_bytes : int, optional
+        The largest total size of the cached maps, in bytes.
+        The default is 256 MB.
+    default_colormap : str, optional
+        The colormap used when none is requested.
+        The default is 'rainbow'.
+
+    Returns
+    -------
+    None.
+
+    '''
+    server = ThreadingHTTPServer((host, port), make_handler(data, FrameCache(cache_bytes), default_colormap))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    import clean_data
+    import derived_metrics
+
+    parser = argparse.ArgumentParser(description='Serve maps of the NYC Covid-19 data.')
+    parser.add_argument('--data-dir', default='../coronavirus-data/', help='folderpath to the coronavirus-data repository')
+    parser.add_argument('--cache-dir', default=None, help='folderpath in which to cache the data between runs')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--cache-mb', type=int, default=256, help='size of the cache of rendered maps, in MB')
+    parser.add_argument('--colormap', default='rainbow', help='colormap used when none is requested')
+    args = parser.parse_args()
+
+    data = clean_data.read_all_zcta_data(args.data_dir, cache_dir=args.cache_dir)
+    data = derived_metrics.add_derived_metrics(data, ['COVID_CASE_RATE', 'COVID_CASE_COUNT', 'COVID_DEATH_RATE'])
+    print("Serving on http://%s:%s/"%(args.host, args.port))
+    serve(data, args.host, args.port, args.cache_mb * 2**20, args.colormap)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Functions for making animated gifs (or mp4 videos) of the NYC Covid-19 data
+directly, without writing an svg per date and converting them with
+ImageMagick.
+
+The map is rasterized once into a "label raster", holding for each pixel the
+index of the ZCTA drawn there. Each frame is then just a lookup table from
+those indices to the day's colors: for gifs the lookup table is the frame's
+palette, for videos it is applied with numpy. The legend (title, gradient and
+range) is drawn into the label raster once, with labels of its own, and only
+the date is drawn again for each frame, as in the svgs.
+
+Making gifs needs an installation of Pillow. To install it, run
+
+conda install pillow
+
+Making mp4 videos needs the ffmpeg executable.
+
+"""
+
+import re
+import subprocess
+import numpy as np
+
+import svg_utilities
+import map_geometry
+import instrumentation
+
+# Size and offset of the map in nychealth's svg
+map_width = 649
+map_height = 679
+map_offset = (6, 5)
+
+# Labels of the label raster other than those of the ZCTAs, and their colors
+background_label = 0
+no_data_label = 1
+first_zcta_label = 2
+background_rgb = (255, 255, 255)
+no_data_rgb = (211, 211, 211)
+
+# Labels after those of the ZCTAs: the colors of the legend's gradient, then
+# shades of gray from white to black for the antialiased text
+legend_gradient_colors = 64
+text_shades = 8
+
+# Where nychealth's svg draws its legend, in pixels of the map: the left edge
+# and the baselines of the date and of the title, the box of the gradient,
+# the baseline of the labels of its ends and the size of the font
+legend_x = 24
+legend_date_baseline = 19
+legend_title_baseline = 33
+legend_gradient_box = (24, 38, 124, 54)
+legend_labels_baseline = 64
+legend_font_size = 10
+
+# Label rasters already made by this process, keyed by width
+_label_rasters = {}
+
+def svg_path_to_path(d):
+    r'''
+    Convert the 'd' attribute of an svg path made only of absolute M, L and Z
+    commands (like those of nychealth's map) to a matplotlib Path.
+    '''
+    from matplotlib.path import Path
+    vertices = []
+    codes = []
+    for command, x, y in re.findall(r'([MLZ])([-0-9.e]*),?([-0-9.e]*)', d):
+        if command == 'Z':
+            vertices.append(vertices[-1])
+            codes.append(Path.CLOSEPOLY)
+        else:
+            vertices.append((float(x), float(y)))
+            codes.append(Path.MOVETO if command == 'M' else Path.LINETO)
+    return Path(vertices, codes)
+
+def read_map_paths(map_filename='NYCmap06-12.svg'):
+    r'''
+    Read the shapes of nychealth's map, from its geometry index or from the
+    map itself (see 'map_geometry.load_map_geometry').
+
+    Parameters
+    ----------
+    map_filename : str, optional
+        The name of nychealth's map file.
+        The default is 'NYCmap06-12.svg'.
+
+    Returns
+    -------
+    zctas : list
+        The ZCTA of each shape, in the order they are drawn.
+    zcta_paths : list
+        The matplotlib Path of each ZCTA.
+    background_paths : list
+        The matplotlib Paths of the gray shapes drawn beneath the ZCTAs.
+
+    '''
+    geometry = map_geometry.load_map_geometry(map_filename)
+    background_paths = [svg_path_to_path(d) for d in re.findall(r'd="([MLZ][^"]*)" fill="lightgray"', geometry.header)]
+    zcta_paths = [svg_path_to_path(d) for d in geometry.paths]
+    return geometry.zctas, zcta_paths, background_paths
+
+def rasterize_zcta_labels(width=map_width):
+    r'''
+    Rasterize the map into a label raster (see the module's description).
+
+    The result is kept for the rest of the process.
+
+    Parameters
+    ----------
+    width : int, optional
+        The width in pixels of the raster. Its height is scaled accordingly.
+        The default is the width of the map, 649.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        An array of dtype uint8 and shape (height, width) whose entries are
+        'background_label', 'no_data_label' or 'first_zcta_label' plus the
+        position of a ZCTA in 'zctas'. Every ZCTA has at least one pixel,
+        that of its centroid if it is too small to be drawn at this width.
+    zctas : list
+        The ZCTAs of the map.
+
+    '''
+    if width in _label_rasters:
+        return _label_rasters[width]
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.patches import PathPatch
+    zctas, zcta_paths, background_paths = read_map_paths()
+    scale = width / map_width
+    height = int(round(map_height * scale))
+
+    # Draw each shape without antialiasing in a "color" whose red channel
+    # is its label, on a 72 dpi figure so that a point is a pixel
+    def label_color(label):
+        return (label / 255, 0, 0)
+    fig = Figure(figsize=(width / 72, height / 72), dpi=72)
+    fig.patch.set_facecolor(label_color(background_label))
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(-map_offset[0], map_width - map_offset[0])
+    ax.set_ylim(map_height - map_offset[1], -map_offset[1])
+    ax.axis('off')
+    for path in background_paths:
+        ax.add_patch(PathPatch(path, facecolor=label_color(no_data_label), edgecolor='none', antialiased=False))
+    for i, path in enumerate(zcta_paths):
+        # ZCTAs have a white border of width 0.5
+        ax.add_patch(PathPatch(path, facecolor=label_color(first_zcta_label + i), edgecolor=label_color(background_label), linewidth=0.5 * scale, antialiased=False))
+    canvas.draw()
+    labels = np.asarray(canvas.buffer_rgba())[:, :, 0].copy()
+
+    # ZCTAs covered by their own border at this width keep a pixel
+    counts = np.bincount(labels.ravel(), minlength=256)
+    for i, (x, y) in enumerate(map_geometry.load_map_geometry().centroids):
+        if counts[first_zcta_label + i] == 0:
+            labels[min(int((y + map_offset[1]) * scale), height - 1), min(int((x + map_offset[0]) * scale), width - 1)] = first_zcta_label + i
+
+    _label_rasters[width] = (labels, zctas)
+    return labels, zctas
+
+def rasterize_text(text, size, bold=False):
+    r'''
+    Rasterize a line of text in matplotlib's sans-serif font.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+    size : float
+        The size of the font, in pixels.
+    bold : boolean, optional
+        Whether the font is bold.
+        The default is False.
+
+    Returns
+    -------
+    coverage : numpy.ndarray
+        An array of dtype uint8 and shape (height, width) of how much of
+        each pixel the text covers, from 0 to 255.
+    baseline : int
+        The row of 'coverage' just below the text's baseline.
+
+    '''
+    from matplotlib.font_manager import FontProperties, findfont, get_font
+    font = get_font(findfont(FontProperties(family='sans-serif', weight='bold' if bold else 'normal')))
+    font.clear()
+    font.set_size(size, 72)
+    font.set_text(text, 0.0)
+    font.draw_glyphs_to_bitmap(antialiased=True)
+    coverage = np.asarray(font.get_image())
+    # The bitmap has a row of padding below the descent
+    return coverage, coverage.shape[0] - int(round(font.get_descent() / 64)) - 1
+
+def draw_text(labels, first_text_label, text, x, baseline, size, bold=False, anchor='start'):
+    r'''
+    Draw a line of text into a label raster, in place, with the labels of
+    'text_shades' shades of gray from 'first_text_label' on.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        The label raster.
+    first_text_label : int
+        The label of the lightest shade of gray.
+    text, size, bold
+        The parameters of 'rasterize_text'.
+    x : int
+        The column of the start (or end) of the text.
+    baseline : int
+        The row just below the text's baseline.
+    anchor : str, optional
+        'start' or 'end': whether 'x' is where the text starts or ends, as
+        with the svg text-anchor attribute.
+        The default is 'start'.
+
+    Returns
+    -------
+    None.
+
+    '''
+    coverage, text_baseline = rasterize_text(text, size, bold)
+    top = baseline - text_baseline
+    left = x - coverage.shape[1] if anchor == 'end' else x
+    # Clip the text to the raster
+    rows = slice(max(top, 0), min(top + coverage.shape[0], labels.shape[0]))
+    columns = slice(max(left, 0), min(left + coverage.shape[1], labels.shape[1]))
+    coverage = coverage[rows.start - top:rows.stop - top, columns.start - left:columns.stop - left]
+    shades = (coverage.astype(int) * text_shades + 254) // 255
+    region = labels[rows, columns]
+    region[shades > 0] = first_text_label + shades[shades > 0] - 1
+
+def legend_labels(labels, zctas, legend_title, min_rate, max_rate):
+    r'''
+    Draw the parts of the legend that are the same on every frame (its
+    title, gradient and range) into a copy of a label raster.
+
+    The gradient's labels are the 'legend_gradient_colors' labels after
+    those of the ZCTAs, and the text's the 'text_shades' labels after them
+    (see 'day_color_table').
+
+    Returns
+    -------
+    numpy.ndarray
+        The label raster with the legend.
+
+    '''
+    first_gradient_label = first_zcta_label + len(zctas)
+    first_text_label = first_gradient_label + legend_gradient_colors
+    if first_text_label + text_shades > 256:
+        raise ValueError("The map has too many ZCTAs for a legend in 256 labels")
+    labels = labels.copy()
+    scale = labels.shape[1] / map_width
+
+    left, top, right, bottom = [int(round(scale * coordinate)) for coordinate in legend_gradient_box]
+    labels[top:bottom, left:right] = first_gradient_label + np.arange(right - left) * legend_gradient_colors // (right - left)
+    draw_text(labels, first_text_label, legend_title, int(round(scale * legend_x)), int(round(scale * legend_title_baseline)), scale * legend_font_size, bold=True)
+    draw_text(labels, first_text_label, svg_utilities.legend_rate_text(min_rate), left, int(round(scale * legend_labels_baseline)), scale * legend_font_size)
+    draw_text(labels, first_text_label, svg_utilities.legend_rate_text(max_rate), right, int(round(scale * legend_labels_baseline)), scale * legend_font_size, anchor='end')
+    return labels
+
+def date_labels(legend, zctas, date):
+    r'''
+    Draw the date into a copy of a label raster with a legend (see
+    'legend_labels'), as in the legend of the svgs.
+    '''
+    labels = legend.copy()
+    scale = labels.shape[1] / map_width
+    draw_text(labels, first_zcta_label + len(zctas) + legend_gradient_colors, svg_utilities.legend_date_text(date), int(round(scale * legend_x)), int(round(scale * legend_date_baseline)), scale * legend_font_size, bold=True)
+    return labels
+
+def day_color_table(data, zctas, plot_field, date, min_rate, max_rate, colormap):
+    r'''
+    Compute the lookup table from labels to colors for one date.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of dtype uint8 and shape (256, 3) holding the rgb value of
+        each label. ZCTAs without data are gray. The labels of the legend
+        (see 'legend_labels') get the colors of the colormap and shades of
+        gray.
+
+    '''
+    table = np.zeros((256, 3), dtype=np.uint8)
+    table[background_label] = background_rgb
+    table[no_data_label] = no_data_rgb
+    values = data.xs(date, level=1)[plot_field].reindex(zctas).to_numpy(dtype=float)
+    rgb = np.clip(svg_utilities.values_to_rgb(values, min_rate, max_rate, colormap), 0, 255)
+    rgb[np.isnan(values)] = no_data_rgb
+    table[first_zcta_label:first_zcta_label + len(zctas)] = rgb
+
+    # The legend's gradient samples the colormap at the middle of each of
+    # its colors, and its text is drawn on white
+    first_gradient_label = first_zcta_label + len(zctas)
+    gradient = (np.arange(legend_gradient_colors) + 0.5) / legend_gradient_colors
+    table[first_gradient_label:first_gradient_label + legend_gradient_colors] = np.clip(svg_utilities.values_to_rgb(gradient, 0, 1, colormap), 0, 255)
+    first_text_label = first_gradient_label + legend_gradient_colors
+    gray = np.round(255 * (1 - np.arange(1, text_shades + 1) / text_shades))
+    table[first_text_label:first_text_label + text_shades] = gray[:, np.newaxis]
+    return table
+
+def iter_animation_frames(data, plot_field='COVID_CASE_RATE', legend_title=None, colormap='rainbow', dates=None, min_rate=None, max_rate=None, width=map_width):
+    r'''
+    Generate the frames of an animation as rgb arrays, one for each
+    specified date.
+
+    Parameters
+    ----------
+    The parameters 'data', 'plot_field', 'legend_title', 'colormap', 'dates',
+    'min_rate' and 'max_rate' are the same as those of
+    'svg_utilities.mi_generate_multiple_svgs_from_one_dataframe'.
+    width : int, optional
+        The width in pixels of the frames.
+        The default is the width of the map, 649.
+
+    Yields
+    ------
+    date : pandas.Timestamp
+        The date of the frame.
+    frame : numpy.ndarray
+        The frame, of dtype uint8 and shape (height, width, 3).
+
+    '''
+    dates, min_rate, max_rate = svg_utilities._dates_and_range(data, plot_field, dates, min_rate, max_rate)
+    labels, zctas = rasterize_zcta_labels(width)
+    legend = legend_labels(labels, zctas, plot_field if legend_title is None else legend_title, min_rate, max_rate)
+    for date in dates:
+        yield date, day_color_table(data, zctas, plot_field, date, min_rate, max_rate, colormap)[date_labels(legend, zctas, date)]
+
+def mi_generate_animation(data, filename, plot_field='COVID_CASE_RATE', legend_title=None, colormap='rainbow', dates=None, min_rate=None, max_rate=None, width=map_width, delay=50, verbose=True):
+    r'''
+    Make an animated gif or mp4 video of maps of NYC (by ZCTA), one frame for
+    each specified date, colored according to value of some data and a
+    specified color palette.
+
+    Parameters
+    ----------
+    The parameters 'data', 'plot_field', 'legend_title', 'colormap', 'dates',
+    'min_rate', 'max_rate' and 'verbose' are the same as those of
+    'svg_utilities.mi_generate_multiple_svgs_from_one_dataframe'.
+    filename : str
+        The name of the file to create. Its extension, '.gif' or '.mp4',
+        determines its format. Either way the frames are written one at a
+        time, so that memory use doesn't depend on the number of dates.
+    width : int, optional
+        The width in pixels of the animation. Below the width of the map, the
+        legend's text gets hard to read and the smallest ZCTAs are a pixel.
+        The default is the width of the map, 649.
+    delay : int, optional
+        The time each frame is shown, in hundredths of a second (as with
+        ImageMagick's -delay).
+        The default is 50.
+
+    Returns
+    -------
+    None.
+
+    '''
+    dates, min_rate, max_rate = svg_utilities._dates_and_range(data, plot_field, dates, min_rate, max_rate)
+    labels, zctas = rasterize_zcta_labels(width)
+    legend = legend_labels(labels, zctas, plot_field if legend_title is None else legend_title, min_rate, max_rate)
+
+    if filename.lower().endswith('.gif'):
+        from PIL import Image, GifImagePlugin
+        # Each frame is the label raster with the day's colors as palette.
+        # The frames are written as they are made (Pillow's save_all would
+        # keep all of them), so memory use doesn't grow with the dates.
+        with open(filename, 'wb') as outfile:
+            for i, date in enumerate(dates):
+                if verbose:
+                    instrumentation.log_event('frame_written', date=date.strftime('%Y-%m-%d'))
+                frame = Image.fromarray(date_labels(legend, zctas, date))
+                frame.putpalette(day_color_table(data, zctas, plot_field, date, min_rate, max_rate, colormap).ravel().tolist())
+                if i == 0:
+                    header = GifImagePlugin.getheader(frame, info={'loop': 0, 'duration': 10 * delay, 'optimize': False})[0]
+                    outfile.write(b''.join(header))
+                outfile.write(b''.join(GifImagePlugin.getdata(frame, duration=10 * delay, include_color_table=True)))
+            outfile.write(b';')
+    elif filename.lower().endswith('.mp4'):
+        height, width = labels.shape
+        # Stream the raw frames to ffmpeg, padding them to even dimensions
+        ffmpeg = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error',
+                                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%sx%s'%(width, height), '-r', '%s'%(100 / delay), '-i', '-',
+                                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white', '-pix_fmt', 'yuv420p', filename],
+                                  stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            for date in dates:
+                if verbose:
+                    instrumentation.log_event('frame_written', date=date.strftime('%Y-%m-%d'))
+                ffmpeg.stdin.write(day_color_table(data, zctas, plot_field, date, min_rate, max_rate, colormap)[date_labels(legend, zctas, date)].tobytes())
+        except BrokenPipeError:
+            # ffmpeg stopped reading; its error output says why
+            pass
+        stderr = ffmpeg.communicate()[1]
+        if ffmpeg.returncode != 0:
+            raise RuntimeError("ffmpeg failed to create %s: %s"%(filename, stderr.decode(errors='replace').strip()))
+    else:
+        raise ValueError("Unsupported animation format: " + filename)
+    return
@@ -12,11 +12,18 @@ Department's Covid-19 data.
 
 
 import os, re
+import io
+import gzip
+import json
 import locale
-import matplotlib.pyplot as plt
+from collections import namedtuple
+from functools import partial
 import pandas as pd
 import numpy as np
 
+import instrumentation
+import map_geometry
+
 # The fields present in the (most recent) NYC Covid-19 data tables
 ZCTA_fields = ['Case Rate per 100k',
     'ZIP Code',
@@ -50,6 +57,54 @@ double_zips = {
     11217 : '11217, 11243'
     }
 
+# The opening of a ZCTA's path element in an svg, with its aria-label listing
+# the value of each of the fields of 'ZCTA_fields'
+aria_label_format = "<path aria-label=\"" + ";\n\t".join(field + ": %s" for field in ZCTA_fields) + "\"\n"
+
+# The legend text of nychealth's map, which is replaced in each generated svg.
+# Each is mapped to the name of the slot it becomes in a compiled template.
+template_legend_slots = {
+    '>Case Rate per 100k' : 'legend_title_text',
+    '\'Case Rate per 100k' : 'legend_title_aria',
+    '551 to 4,429' : 'legend_range',
+    '551<' : 'legend_min',
+    '4,429<' : 'legend_max'
+    }
+
+# A template file held in memory, split into static chunks around the slots
+# that change from one svg to the next:
+#   header : the text preceding the first ZCTA
+#   zcta_pieces : for each ZCTA (in template order) the pieces of its path
+#       element surrounding its fill color; its aria-label precedes them
+#   footer_pieces : the pieces of the end segment surrounding the legend slots
+#   footer_slots : the names of the legend slots, in order of appearance
+#   zctas : the ZCTA of each of zcta_pieces, or None if unknown, in which
+#       case the ZCTAs of the data are taken to be in template order
+CompiledTemplate = namedtuple('CompiledTemplate', ['header', 'zcta_pieces', 'footer_pieces', 'footer_slots', 'zctas'], defaults=[None])
+
+# Compiled templates already loaded by this process, keyed by file path
+_compiled_templates = {}
+
+# The lookup table of a colormap:
+#   N : the number of colors of the colormap
+#   rgb : integer array of shape (N + 3, 3) of the svg rgb value of each of
+#       its colors, followed by its under and over colors and 'no_data_rgb'
+#   rgb_strings : the corresponding 'rgb(r, g, b)' strings
+ColormapTable = namedtuple('ColormapTable', ['N', 'rgb', 'rgb_strings'])
+
+# Lookup tables of the colormaps already used by this process, keyed by name
+_colormap_tables = {}
+
+# The color of ZCTAs without data (NaN values): the lightgray of the map's
+# shapes that have no ZCTA, rather than the colormap's color for bad values
+no_data_rgb = (211, 211, 211)
+
+# One of the maps made for each date by
+# 'mi_generate_batch_of_svgs_from_one_dataframe'. The fields mean the same as
+# the parameters of 'mi_generate_multiple_svgs_from_one_dataframe' of the
+# same name; all but plot_field are optional.
+MapSpec = namedtuple('MapSpec', ['plot_field', 'colormap', 'min_rate', 'max_rate', 'legend_title', 'filename_prefix', 'detail'], defaults=['rainbow', None, None, None, 'NYC', 'full'])
+
 def rgb1to256(rgb1):
     r'''
     A helper function that converts from matplotlibs rgb format to svg's.
@@ -68,61 +123,424 @@ def rgb1to256(rgb1):
     '''
     return tuple(np.ceil(256 * c).astype('int') - 1 for c in rgb1[:3])
 
-def initalize_template_file(colormap='rainbow'):
+def get_colormap_table(colormap='rainbow'):
+    r'''
+    Get the lookup table of a colormap, computing it the first time it is
+    needed by this process.
+
+    Parameters
+    ----------
+    colormap : str or matplotlib.colors.Colormap, optional
+        The name of a standard matplotlib color map, or a color map itself
+        (whose table is then not kept).
+        The default is 'rainbow'.
+
+    Raises
+    ------
+    ValueError
+        If there is no color map with that name.
+
+    Returns
+    -------
+    ColormapTable
+        The lookup table of the colormap.
+
+    '''
+    if not isinstance(colormap, str):
+        return _make_colormap_table(colormap)
+    if colormap not in _colormap_tables:
+        _colormap_tables[colormap] = _make_colormap_table(get_colormap(colormap))
+    return _colormap_tables[colormap]
+
+def get_colormap(colormap):
+    r'''
+    Get a standard matplotlib color map by name.
+
+    This goes through matplotlib's colormap registry rather than pyplot, so
+    that no plotting backend gets loaded.
+
+    Raises
+    ------
+    ValueError
+        If there is no color map with that name.
+
+    '''
+    import matplotlib
+    if not hasattr(matplotlib, 'colormaps'):
+        # matplotlib < 3.5
+        from matplotlib import cm
+        return cm.get_cmap(colormap)
+    try:
+        return matplotlib.colormaps[colormap]
+    except KeyError:
+        raise ValueError("%s is not a valid colormap name"%(colormap,))
+
+def colormap_names():
+    r'''
+    Get the names of the standard matplotlib color maps (see 'get_colormap').
+    '''
+    import matplotlib
+    if not hasattr(matplotlib, 'colormaps'):
+        # matplotlib < 3.5
+        from matplotlib import cm
+        return list(cm.cmap_d)
+    return list(matplotlib.colormaps)
+
+def _make_colormap_table(cm):
+    # One entry for each of the colormap's colors followed by its under and
+    # over colors, as in matplotlib, and the color of missing data
+    rgba = np.concatenate([cm(np.arange(cm.N)), cm(np.array([-1.0, 2.0]))])
+    rgb = np.concatenate([np.ceil(256 * rgba[:, :3]).astype('int') - 1, [no_data_rgb]])
+    return ColormapTable(cm.N, rgb, ["rgb(%d, %d, %d)"%(r, g, b) for r, g, b in rgb.tolist()])
+
+def colormap_indices(values, min_rate, max_rate, N):
+    r'''
+    Compute the entries of a colormap's lookup table that some data values
+    map to, exactly as matplotlib does when applying the colormap.
+
+    Parameters
+    ----------
+    values : numpy.ndarray (or listable)
+        The data values to be colored.
+    min_rate : float (or other numerical type)
+        The value that maps to the leftmost colormap color.
+    max_rate : float (or other numerical type)
+        The value that maps to the rightmost colormap color.
+    N : int
+        The number of colors of the colormap.
+
+    Returns
+    -------
+    numpy.ndarray
+        The index in the lookup table of each value.
+
+    '''
+    scaled = (np.asarray(values, dtype=float) - min_rate) / (max_rate - min_rate) * N
+    scaled[scaled == N] = N - 1
+    indices = np.clip(np.nan_to_num(scaled, nan=-1), -1, N).astype('int')
+    indices[scaled < 0] = N
+    indices[scaled >= N] = N + 1
+    indices[np.isnan(scaled)] = N + 2
+    return indices
+
+def values_to_rgb(values, min_rate, max_rate, colormap):
+    r'''
+    Convert an array of data values into svg rgb values in a single pass.
+
+    This is the vectorized analogue of calling 'rgb1to256(cm(value01))' on
+    each value separately, using the colormap's lookup table.
+
+    Parameters
+    ----------
+    values : numpy.ndarray (or listable)
+        The data values to be colored.
+    min_rate : float (or other numerical type)
+        The value that maps to the leftmost colormap color.
+    max_rate : float (or other numerical type)
+        The value that maps to the rightmost colormap color.
+    colormap : str or matplotlib.colors.Colormap
+        The name of a standard matplotlib color map, or a color map itself.
+
+    Returns
+    -------
+    numpy.ndarray
+        An integer array of shape (len(values), 3) holding the rgb value of
+        each value with entries between 0 and 255. As with 'rgb1to256', an
+        entry of 0 comes out as -1. NaN values get 'no_data_rgb'.
+
+    '''
+    table = get_colormap_table(colormap)
+    return table.rgb[colormap_indices(values, min_rate, max_rate, table.N)]
+
+def values_to_rgb_strings(values, min_rate, max_rate, colormap):
+    r'''
+    Convert an array of data values into svg rgb strings in a single pass
+    (see 'values_to_rgb').
+
+    Returns
+    -------
+    list
+        A list of strings of the form 'rgb(r, g, b)', one for each value.
+
+    '''
+    table = get_colormap_table(colormap)
+    rgb_strings = table.rgb_strings
+    return [rgb_strings[i] for i in colormap_indices(values, min_rate, max_rate, table.N).tolist()]
+
+def day_dataframe_to_label_values(zcta_data, zips=None):
+    r'''
+    Format the values shown in the aria-labels of every ZCTA for one day of
+    data at once.
+
+    Each column needed by the labels is pulled out of 'zcta_data' a single
+    time as an array, rather than looking up each ZCTA's row separately.
+
+    Parameters
+    ----------
+    zcta_data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 is a pandas.Timestamp representing the date of the data.
+        Only the first date present is used.
+    zips : listable, optional
+        The ZCTAs (in template order) for which to produce labels. Those
+        without data are labeled with NaN values.
+        The default is None. The ZCTAs are then taken from the level 0 index
+        of 'zcta_data'.
+
+    Returns
+    -------
+    list
+        A list with, for each ZCTA, a tuple of the strings to show for each
+        of the fields of 'ZCTA_fields'.
+
+    '''
+    if zips is None:
+        zips = zcta_data.index.levels[0]
+    date = zcta_data.index[0][1]
+    day = zcta_data.xs(date, level=1).reindex(zips)
+    # Values are formatted as they would be when read off of a single row
+    row_dtype = zcta_data.iloc[0].dtype
+    columns = []
+    for field in ZCTA_fields:
+        if field == 'ZIP Code':
+            columns.append(["%s"%(double_zips[zcta] if zcta in double_zips else zcta) for zcta in zips])
+        else:
+            columns.append(["%s"%(value,) for value in day[fields_to_data_by_modzcta_dict[field]].to_numpy(dtype=row_dtype).tolist()])
+    return list(zip(*columns))
+
+def day_dataframe_to_aria_labels(zcta_data, zips=None):
+    r'''
+    Build the aria-label blocks of every ZCTA for one day of data at once.
+
+    Parameters
+    ----------
+    zcta_data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 is a pandas.Timestamp representing the date of the data.
+        Only the first date present is used.
+    zips : listable, optional
+        The ZCTAs (in template order) for which to produce labels.
+        The default is None. The ZCTAs are then taken from the level 0 index
+        of 'zcta_data'.
+
+    Returns
+    -------
+    list
+        A list of strings, each the opening of a '<path' element with its
+        aria-label, one for each ZCTA.
+
+    '''
+    return [aria_label_format%values for values in day_dataframe_to_label_values(zcta_data, zips)]
+
+def compile_template(template, zctas=None):
+    r'''
+    Split the text of a template file into its static chunks and slots.
+
+    Parameters
+    ----------
+    template : str
+        The contents of a template file created by 'initalize_template_file'.
+    zctas : list, optional
+        The ZCTA of each of the template's shapes, in order.
+        The default is None, in which case they are unknown.
+
+    Returns
+    -------
+    CompiledTemplate
+        The compiled template, from which an svg is produced by joining its
+        chunks with the slot values of a given day.
+
+    '''
+    rgb_re = re.compile(r'rgb\([0-9]*, [0-9]*, [0-9]*\)')
+    legend_re = re.compile('(' + '|'.join(re.escape(text) for text in template_legend_slots) + ')')
+    
+    # The template has one line for the header, then one line per ZCTA, and
+    # ends with a footer without a newline
+    lines = template.split('\n')
+    header = lines[0] + '\n'
+    zcta_pieces = [tuple(rgb_re.split(line + '\n')) for line in lines[1:-1]]
+    tokens = legend_re.split(lines[-1])
+    footer_pieces = tuple(tokens[::2])
+    footer_slots = tuple(template_legend_slots[text] for text in tokens[1::2])
+    return CompiledTemplate(header, zcta_pieces, footer_pieces, footer_slots, zctas)
+
+def template_filename(colormap='rainbow', detail='full'):
+    r'''
+    The name of the template file for a colormap and level of detail.
+    '''
+    if detail == 'full':
+        return "template_" + colormap + ".svg"
+    return "template_" + colormap + "_" + detail + ".svg"
+
+def load_compiled_template(colormap='rainbow', detail='full'):
+    r'''
+    Get the compiled version of the template file for a colormap and level
+    of detail.
+
+    The template file is only read and compiled the first time it is needed
+    by this process; afterwards the compiled template is kept in memory. The
+    ZCTAs of its shapes are taken from the geometry of the map (see
+    'map_geometry.load_map_geometry'), when the map or its index is around.
+
+    Parameters
+    ----------
+    colormap : str, optional
+        The name of a standard matplotlib color map.
+        The default is 'rainbow'.
+    detail : str, optional
+        The level of detail of the map, one of those of
+        'map_geometry.detail_levels'.
+        The default is 'full'.
+
+    Returns
+    -------
+    CompiledTemplate
+        The compiled version of 'template_colormap.svg' (or of
+        'template_colormap_detail.svg' for simplified maps).
+
+    '''
+    filename = os.path.abspath(template_filename(colormap, detail))
+    if filename not in _compiled_templates:
+        with open(filename, 'r') as template_file:
+            template = compile_template(template_file.read())
+        zctas = _map_zctas()
+        if zctas is not None and len(zctas) == len(template.zcta_pieces):
+            template = template._replace(zctas=zctas)
+        _compiled_templates[filename] = template
+    return _compiled_templates[filename]
+
+def _map_zctas(map_filename='NYCmap06-12.svg'):
+    # The ZCTAs of the map, if it or its geometry index is around
+    if os.path.exists(map_filename) or os.path.exists(map_geometry.geometry_filename(map_filename)):
+        return map_geometry.load_map_geometry(map_filename).zctas
+    return None
+
+def initalize_template_file(colormap='rainbow', details=('full',), in_memory=False):
     r'''
     Creates template files for use with 'mi_generate_svg_from_day_dataframe'.
     
-    This function only needs to be run once for each colormap used.
+    This function only needs to be run once for each colormap used. The map
+    is read from its geometry index, which is made first if needed (see
+    'map_geometry.make_map_geometry_index'), unless 'in_memory' is set.
 
     Parameters
     ----------
     colormap : str, optional
         The name of a standard matplotlib color map.
         The default is 'rainbow'.
+    details : listable, optional
+        The levels of detail of the maps to make templates for, among those
+        of 'map_geometry.detail_levels'. Below 'full', the shapes of the map
+        are simplified (see 'map_geometry.simplify_paths') and their
+        coordinates rounded, which makes much smaller svgs, e.g. for
+        thumbnails or animation frames.
+        The default is ('full',), the map as is.
+    in_memory : boolean, optional
+        Whether to only keep the compiled templates for the rest of the
+        process, without writing any file, e.g. in a server.
+        The default is False.
 
     Returns
     -------
     None.
-        Creates the file 'template_colormap.svg' which is used by
-        'mi_generate_svg_from_day_dataframe' to create full svg files.
+        Creates the file 'template_colormap.svg' (and
+        'template_colormap_detail.svg' for each simplified level of detail)
+        which is used by 'mi_generate_svg_from_day_dataframe' to create full
+        svg files. Its compiled version is also kept in memory for the rest
+        of the process (see 'load_compiled_template').
 
     '''
+    if isinstance(details, str):
+        details = [details]
+    if not in_memory:
+        map_geometry.make_map_geometry_index('NYCmap06-12.svg')
+    for detail in details:
+        _initalize_template_file(colormap, detail, in_memory)
+    return
+
+def _initalize_template_file(colormap, detail, in_memory):
     # Some regex used in creating the legend
     offset_re = re.compile("\".*?\"")
-    rgb_re = re.compile('rgb\([0-9]*, [0-9]*, [0-9]*\)')
+    rgb_re = re.compile(r'rgb\([0-9]*, [0-9]*, [0-9]*\)')
     
-    with open("template_" + colormap + ".svg", 'w') as outfile:
-        # Get nychealth's map file, it's all one line
-        map_file = open('NYCmap06-12.svg', 'r')
-        LINE = map_file.readline()
-        map_file.close()
-        
-        # Break it up into segments based on ZCTA
-        tokens = LINE.split("<path aria-label=")
-        
-        # Adjust the legend colours in the initial segment
-        cm = eval("plt.cm." + colormap)
-        header_delim = "<stop offset="
-        header_tokens = tokens[0].split(header_delim)
-        outfile.write(header_tokens[0])
-        step = 1/21
-        for i in range(22):
-            val = step * i
-            this_rgb = rgb1to256(cm(val))
-            header_tokens[i+1] = header_delim + rgb_re.sub("rgb%s"%(this_rgb,), offset_re.sub("\"%s\""%(val), header_tokens[i+1], 1), 1)
-            if i == 21:
-                header_tokens[i+1] += "\n"
-            outfile.write(header_tokens[i+1])
-        delim = 'role='
-        for token in tokens[1:-1]:
-            outfile.write(delim + token.split(delim)[1] + "\n")
-        delimend = "stroke-width=\"0.5\"></path>"
-        token, endgame = tokens[-1].split(delimend)
-        outfile.write(delim + token.split(delim)[1] + delimend + "\n")
-        outfile.write(endgame)
-    return
+    # Get the geometry of nychealth's map, at this level of detail
+    geometry = map_geometry.load_simplified_geometry(detail, 'NYCmap06-12.svg')
+    
+    # Adjust the legend colours in the initial segment
+    header_delim = "<stop offset="
+    header_tokens = geometry.header.split(header_delim)
+    out = [header_tokens[0]]
+    step = 1/21
+    for i in range(22):
+        val = step * i
+        this_rgb = values_to_rgb_strings([val], 0, 1, colormap)[0]
+        header_tokens[i+1] = header_delim + rgb_re.sub(this_rgb, offset_re.sub("\"%s\""%(val), header_tokens[i+1], 1), 1)
+        if i == 21:
+            header_tokens[i+1] += "\n"
+        out.append(header_tokens[i+1])
+    # Then one line per ZCTA, without its aria-label, and the end segment
+    for d, fill in zip(geometry.paths, geometry.fills):
+        out.append(map_geometry.zcta_path_format%(d, fill) + "\n")
+    out.append(geometry.footer)
+    template = ''.join(out)
+    
+    filename = template_filename(colormap, detail)
+    if not in_memory:
+        with open(filename, 'w') as outfile:
+            outfile.write(template)
+    # Keep the compiled template for this process
+    _compiled_templates[os.path.abspath(filename)] = compile_template(template, geometry.zctas)
+
+def legend_slot_values(date, legend_title, min_rate, max_rate):
+    r'''
+    Compute the text filling in each legend slot of a compiled template.
+
+    Parameters
+    ----------
+    date : pandas.Timestamp
+        The date of the data being plotted.
+    legend_title : str
+        The title to place in the svg's legend.
+    min_rate : float (or other numerical type)
+        The value that maps to the leftmost colormap color.
+    max_rate : float (or other numerical type)
+        The value that maps to the rightmost colormap color.
+
+    Returns
+    -------
+    dict
+        A dictionary from the slot names of 'template_legend_slots' to the
+        text to put in them.
+
+    '''
+    date_str = legend_date_text(date)
+    minstr = legend_rate_text(min_rate)
+    maxstr = legend_rate_text(max_rate)
+    return {
+        'legend_title_text' : "><tspan x=\"0\" dy=\"-1.2em\">"+ date_str + "</tspan><tspan x=\"0\" dy=\"1.4em\">" + legend_title + "</tspan>",
+        'legend_title_aria' : "\'" + date_str + "; " + legend_title,
+        'legend_range' : minstr + " to " + maxstr,
+        'legend_min' : minstr + "<",
+        'legend_max' : maxstr + "<"
+        }
+
+def legend_date_text(date):
+    r'''
+    The line of a legend giving the date of the data, e.g.
+    'Date: Jun 21, 2020'.
+    '''
+    if os.name == 'nt':
+        # On Windows
+        return "Date: %s"%(date.strftime("%b %#d, %Y"))
+    return "Date: %s"%(date.strftime("%b %-d, %Y"))
+
+def legend_rate_text(rate):
+    r'''
+    The label of one end of a legend's range, e.g. '1,234.50'.
+    '''
+    return locale.format_string("%.2f", rate, grouping=True)
 
-def mi_generate_svg_from_day_dataframe(zcta_data, plot_field='COVID_CASE_RATE', legend_title=None, filename_prefix='NYC', min_rate=551, max_rate = 4429.24, colormap='rainbow'):
+def mi_generate_svg_from_day_dataframe(zcta_data, plot_field='COVID_CASE_RATE', legend_title=None, filename_prefix='NYC', min_rate=551, max_rate = 4429.24, colormap='rainbow', outfile=None, detail='full'):
     r'''
     Generate a map of NYC (by ZCTA, in svg format) colored according to value
     of some data and a specified color palette.
@@ -153,6 +571,18 @@ def mi_generate_svg_from_day_dataframe(zcta_data, plot_field='COVID_CASE_RATE',
     colormap : str, optional
         The name of a standard matplotlib color map.
         The default is 'rainbow'.
+    outfile : str or file-like, optional
+        Where to write the svg: either a file name (a name ending in '.svgz'
+        is written gzipped) or an open file-like object, e.g. an io.StringIO,
+        an io.BytesIO, a gzip.GzipFile or a socket's makefile('wb'). Binary
+        file-like objects are written utf-8 encoded bytes.
+        The default is None. The file name is then built from
+        'filename_prefix', 'plot_field', 'colormap' and the date.
+    detail : str, optional
+        The level of detail of the map, one of those of
+        'map_geometry.detail_levels', whose template must have been made by
+        'initalize_template_file'.
+        The default is 'full'.
 
     Returns
     -------
@@ -161,76 +591,152 @@ def mi_generate_svg_from_day_dataframe(zcta_data, plot_field='COVID_CASE_RATE',
         a map of NYC using the specified color palette.
 
     '''
+    with instrumentation.timer('svg.frame'):
+        _generate_svg_from_day_dataframe(zcta_data, plot_field, legend_title, filename_prefix, min_rate, max_rate, colormap, outfile, detail)
+    return
+
+def _generate_svg_from_day_dataframe(zcta_data, plot_field, legend_title, filename_prefix, min_rate, max_rate, colormap, outfile, detail):
     # Preparations for later use
-    rgb_re = re.compile('rgb\([0-9]*, [0-9]*, [0-9]*\)')
-    delta_values = max_rate - min_rate
     locale.setlocale(locale.LC_ALL, '')
     if legend_title is None:
         legend_title = plot_field
     
-    # Get colormap from argument
-    cm = eval("plt.cm." + colormap)
+    # Get (compiled) template from argument
+    template = load_compiled_template(colormap, detail)
     
     # Set output filename based on colormap and 'DATA_DATE" value (there should only be one)
     date = zcta_data.index[0][1]
-    filename =  filename_prefix + "_" + plot_field + "_" + colormap + "_" + date.strftime("%Y-%m-%d-%H-%M-%S") + ".svg"
+    if outfile is None:
+        outfile = svg_filename(filename_prefix, plot_field, colormap, date)
     
-    with open(filename, 'w') as outfile:
-        # Open the svg template file and write out the initial segment
-        template_file = open('template_' + colormap + '.svg', 'r')
-        template_out = template_file.readline()
-        outfile.write(template_out)
-        
-        # For each ZCTA, write out an aria-label with relevant data
-        # and then the corresponding template block with this date's rgb value
-        zips = zcta_data.index.levels[0]
-        for zcta in zips:
-            # First two data fields need custom handling
-            field = ZCTA_fields[0]
-            out = "<path aria-label=\"" + field + ": %s"%(zcta_data.loc[zcta, date][fields_to_data_by_modzcta_dict[field]]) + ";\n"
-            outfile.write(out)
-            out = "\tZIP Code: %s;\n"%(double_zips[zcta] if zcta in double_zips else zcta)
-            outfile.write(out)
-            
-            # Process and write out the remaining data fields
-            for i in range(2, len(ZCTA_fields)):
-                field = ZCTA_fields[i]
-                out = "\t" + field + ": %s"%(zcta_data.loc[zcta, date][fields_to_data_by_modzcta_dict[field]]) + ";\n"
-                if i == len(ZCTA_fields) - 1:
-                    out = out[:-2] + "\"\n"
-                outfile.write(out)
-                
-            # Compute rgb value based on plotted field's value
-            rate = zcta_data.loc[zcta, date][plot_field]
-            rate01 = (rate - min_rate) / delta_values
-            this_rgb = rgb1to256(cm(rate01))
-            template_out = template_file.readline()
-            # Update template's rgb value with computed one
-            template_out = rgb_re.sub("rgb%s"%(this_rgb,), template_out)
-            outfile.write(template_out)
-        
-        # Write out end segment of the file from the template, adding in date and max-min info
-        template_out = template_file.readline()
-        if os.name == 'nt':
-            # On Windows
-            date_str = "Date: %s"%(date.strftime("%b %#d, %Y"))
+    # Compute all aria-labels and rgb values for this date up front
+    zips = template_zctas(template, zcta_data)
+    labels = day_dataframe_to_aria_labels(zcta_data, zips)
+    rates = zcta_data.xs(date, level=1).reindex(zips)[plot_field]
+    _write_day_svg(template, labels, rates, date, legend_title, min_rate, max_rate, colormap, outfile)
+
+def template_zctas(template, data):
+    r'''
+    The ZCTA of each of a compiled template's shapes, for which data is
+    looked up.
+
+    ZCTAs of the data that aren't on the map are left out, and those of the
+    map without data are drawn in 'no_data_rgb'.
+    Templates whose ZCTAs aren't known take the ZCTAs of the data in order,
+    which must then be as many as the template's shapes.
+    '''
+    if template.zctas is not None:
+        return template.zctas
+    zips = data.index.levels[0]
+    if len(zips) != len(template.zcta_pieces):
+        raise ValueError("The data has %s ZCTAs but the template has %s"%(len(zips), len(template.zcta_pieces)))
+    return zips
+
+def svg_filename(filename_prefix, plot_field, colormap, date):
+    r'''
+    The name of the svg file of a date made by
+    'mi_generate_svg_from_day_dataframe' when none is specified.
+    '''
+    return filename_prefix + "_" + plot_field + "_" + colormap + "_" + date.strftime("%Y-%m-%d-%H-%M-%S") + ".svg"
+
+def _write_day_svg(template, labels, rates, date, legend_title, min_rate, max_rate, colormap, outfile):
+    # Color the ZCTAs, fill in the legend and write the svg
+    rgbs = values_to_rgb_strings(rates, min_rate, max_rate, colormap)
+    
+    slot_values = legend_slot_values(date, legend_title, min_rate, max_rate)
+    
+    chunks = iter_svg_chunks(template, labels, rgbs, slot_values)
+    if instrumentation.enabled():
+        chunks = _counted_chunks(chunks)
+    write_svg(chunks, outfile)
+    instrumentation.count('svg.frames_written')
+
+def _counted_chunks(chunks):
+    # Pass the chunks through, counting their (utf-8 encoded) bytes
+    for chunk in chunks:
+        instrumentation.count('svg.bytes_written', len(chunk.encode('utf-8')))
+        yield chunk
+
+def write_svg(chunks, outfile):
+    r'''
+    Write out the chunks of an svg with a single call.
+
+    Parameters
+    ----------
+    chunks : iterable
+        The chunks of text of the svg, e.g. from 'iter_svg_chunks'.
+    outfile : str or file-like
+        A file name (a name ending in '.svgz' is written gzipped) or an open
+        text or binary file-like object. Binary file-like objects are written
+        utf-8 encoded bytes.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if isinstance(outfile, (str, os.PathLike)):
+        if os.fspath(outfile).endswith('.svgz'):
+            with gzip.open(outfile, 'wt', encoding='utf-8') as svgfile:
+                svgfile.writelines(chunks)
         else:
-            date_str = "Date: %s"%(date.strftime("%b %-d, %Y"))
-            
-        legend_title_str = "><tspan x=\"0\" dy=\"-1.2em\">"+ date_str + "</tspan><tspan x=\"0\" dy=\"1.4em\">" + legend_title + "</tspan>"
-        template_out = re.sub(">Case Rate per 100k", legend_title_str, template_out)
-        legend_title_str = "\'" + date_str + "; " + legend_title
-        template_out = re.sub("\'Case Rate per 100k", legend_title_str, template_out)
-        minstr = locale.format_string("%.2f", min_rate, grouping=True)
-        maxstr = locale.format_string("%.2f", max_rate, grouping=True)
-        template_out = template_out.replace("551 to 4,429", minstr + " to " + maxstr)
-        template_out = template_out.replace("551<", minstr + "<")
-        template_out = template_out.replace("4,429<", maxstr + "<")
-        outfile.write(template_out)
-        template_file.close()
-    return
+            with open(outfile, 'w') as svgfile:
+                svgfile.writelines(chunks)
+    elif isinstance(outfile, io.TextIOBase):
+        outfile.writelines(chunks)
+    else:
+        outfile.writelines(chunk.encode('utf-8') for chunk in chunks)
 
-def mi_generate_multiple_svgs_from_one_dataframe(data, plot_field='COVID_CASE_RATE', legend_title=None, filename_prefix='NYC', colormap='rainbow', dates=None, min_rate=None, max_rate=None, verbose=True):
+def assemble_svg(template, labels, rgbs, slot_values):
+    r'''
+    Put together the text of an svg from a compiled template and the values
+    of its slots (see 'iter_svg_chunks').
+
+    Returns
+    -------
+    str
+        The contents of the svg file.
+
+    '''
+    return ''.join(iter_svg_chunks(template, labels, rgbs, slot_values))
+
+def iter_svg_chunks(template, labels, rgbs, slot_values):
+    r'''
+    Generate the chunks of text of an svg from a compiled template and the
+    values of its slots.
+
+    Parameters
+    ----------
+    template : CompiledTemplate
+        The compiled template.
+    labels : list
+        The aria-label block of each ZCTA, in template order.
+    rgbs : list
+        The 'rgb(r, g, b)' fill color of each ZCTA, in template order.
+    slot_values : dict
+        The text to put in each legend slot (see 'legend_slot_values').
+
+    Yields
+    ------
+    str
+        The successive chunks of the svg file's contents.
+
+    '''
+    # Start with the initial segment of the template, then for each ZCTA
+    # add an aria-label with relevant data followed by the corresponding
+    # template block with this date's rgb value
+    yield template.header
+    for label, rgb, pieces in zip(labels, rgbs, template.zcta_pieces):
+        yield label
+        yield rgb.join(pieces)
+    
+    # End with the end segment of the template, adding in date and max-min info
+    for piece, slot in zip(template.footer_pieces, template.footer_slots):
+        yield piece
+        yield slot_values[slot]
+    yield template.footer_pieces[-1]
+
+def mi_generate_multiple_svgs_from_one_dataframe(data, plot_field='COVID_CASE_RATE', legend_title=None, filename_prefix='NYC', colormap='rainbow', dates=None, min_rate=None, max_rate=None, verbose=True, workers=None, executor=None, detail='full'):
     r'''
     Generate a collection of maps of NYC (by ZCTA, in svg format), one for
     each specified date, colored according to value of some data and a
@@ -270,8 +776,23 @@ def mi_generate_multiple_svgs_from_one_dataframe(data, plot_field='COVID_CASE_RA
         The default is None. The max_rate is then computed as the maximum
         attained value.
     verbose : boolean, optional
-        The default is True. Whether to print out the date of the current
-        svg file being created.
+        The default is True. Whether to log (see 'instrumentation.log_event')
+        the date of each svg file created. When generating in parallel, the
+        dates are logged in order as their svg files are completed.
+    workers : int, optional
+        The number of processes among which to divide the dates. Each process
+        is only sent the data of its own dates.
+        The default is None. The svgs are then created one at a time in this
+        process (unless 'executor' is specified).
+    executor : concurrent.futures.Executor, optional
+        An executor (e.g. a concurrent.futures.ProcessPoolExecutor) to
+        generate the svgs with. It is not shut down afterwards.
+        The default is None. An executor is then created if 'workers' is
+        more than 1.
+    detail : str, optional
+        The level of detail of the maps (see
+        'mi_generate_svg_from_day_dataframe').
+        The default is 'full'.
 
     Returns
     -------
@@ -283,6 +804,41 @@ def mi_generate_multiple_svgs_from_one_dataframe(data, plot_field='COVID_CASE_RA
     # Assumes clean_data has removed NaN from ZCTA and cast values to ints
     
     # Get max and min values of the field being plotted, if not specified
+    with instrumentation.timer('svg.range'):
+        dates, min_rate, max_rate = _dates_and_range(data, plot_field, dates, min_rate, max_rate)
+    
+    generate_svg = partial(mi_generate_svg_from_day_dataframe, plot_field=plot_field, legend_title=legend_title, filename_prefix=filename_prefix, min_rate=min_rate, max_rate=max_rate, colormap=colormap, detail=detail)
+    
+    # Make an svg for each date
+    _generate_for_each_date(generate_svg, data, dates, verbose, workers, executor)
+    return
+
+def _generate_for_each_date(generate_svg, data, dates, verbose, workers, executor):
+    # Call generate_svg on the data of each date, in this process or split
+    # among those of an executor
+    if executor is None and (workers is None or workers <= 1):
+        for date in dates:
+            generate_svg(data.loc[pd.IndexSlice[:, date], :])
+            if verbose:
+                instrumentation.log_event('svg_written', date=date.strftime('%Y-%m-%d'))
+        return
+    
+    # Otherwise split the dates among the executor's processes, sending each
+    # only the slices of data for its dates. What the processes record is
+    # sent back with their results.
+    day_dataframes = (data.loc[pd.IndexSlice[:, date], :] for date in dates)
+    if instrumentation.enabled():
+        generate_svg = partial(instrumentation.call_recorded, generate_svg)
+    if executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            _generate_in_parallel(pool, generate_svg, dates, day_dataframes, verbose, chunksize=max(1, len(dates) // (4 * workers)))
+    else:
+        _generate_in_parallel(executor, generate_svg, dates, day_dataframes, verbose)
+    return
+
+def _dates_and_range(data, plot_field, dates, min_rate, max_rate):
+    # Fill in the dates, min_rate and max_rate that aren't specified
     if dates is None:
         if max_rate is None:
             max_rate = data[plot_field].max()
@@ -295,10 +851,190 @@ def mi_generate_multiple_svgs_from_one_dataframe(data, plot_field='COVID_CASE_RA
             max_rate = relevant_data.max()
         if min_rate is None:
             min_rate = data[plot_field].min()
+    return dates, min_rate, max_rate
+
+def _generate_in_parallel(executor, generate_svg, dates, day_dataframes, verbose, chunksize=1):
+    # Results come back in the order of the dates, whatever order the
+    # processes finish them in
+    for date, recorded in zip(dates, executor.map(generate_svg, day_dataframes, chunksize=chunksize)):
+        if recorded is not None:
+            instrumentation.merge(recorded)
+        if verbose:
+            instrumentation.log_event('svg_written', date=date.strftime('%Y-%m-%d'))
+
+def mi_generate_batch_of_svgs_from_one_dataframe(data, specs, dates=None, verbose=True, workers=None, executor=None):
+    r'''
+    Generate several collections of maps of NYC (by ZCTA, in svg format), one
+    for each specified map and date, in a single pass over the dates.
+
+    This makes the same files as calling
+    'mi_generate_multiple_svgs_from_one_dataframe' once per map, but the
+    data of each date is sliced and its aria-labels are formatted only once,
+    with only the fill colors and legend computed for each map.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 are pandas.Timestamp's representing the dates of the
+        data.
+    specs : list
+        The maps to make for each date, as MapSpec's (or tuples or dicts of
+        their fields). The fields of a MapSpec mean the same as the
+        parameters of 'mi_generate_multiple_svgs_from_one_dataframe' of the
+        same name.
+    dates : pandas.DatetimeIndex
+        The dates for which svgs should be created.
+        The default is None. The dates are then taken from the level 1 index
+        of 'data'.
+    The parameters 'verbose', 'workers' and 'executor' are the same as those
+    of 'mi_generate_multiple_svgs_from_one_dataframe'.
+
+    Returns
+    -------
+    None.
+        Creates an svg file for each map and date.
+
+    '''
+    # Fill in the ranges and legend titles that aren't specified
+    specs = [MapSpec(**spec) if isinstance(spec, dict) else MapSpec(*spec) for spec in specs]
+    with instrumentation.timer('svg.range'):
+        for i, spec in enumerate(specs):
+            _, min_rate, max_rate = _dates_and_range(data, spec.plot_field, dates, spec.min_rate, spec.max_rate)
+            specs[i] = spec._replace(min_rate=min_rate, max_rate=max_rate, legend_title=spec.plot_field if spec.legend_title is None else spec.legend_title)
+    if dates is None:
+        dates = data.index.levels[1]
     
-    # Make an svg for each date      
+    # Make every map of each date
+    _generate_for_each_date(partial(_generate_day_svgs, specs=specs), data, dates, verbose, workers, executor)
+    return
+
+def _generate_day_svgs(zcta_data, specs):
+    # Make the svg of each spec for one date, sharing the aria-labels
+    locale.setlocale(locale.LC_ALL, '')
+    date = zcta_data.index[0][1]
+    templates = {}
+    for spec in specs:
+        if (spec.colormap, spec.detail) not in templates:
+            templates[spec.colormap, spec.detail] = load_compiled_template(spec.colormap, spec.detail)
+    # The labels are shared by the templates with the same ZCTAs
+    labels = {}
+    days = {}
+    for spec in specs:
+        template = templates[spec.colormap, spec.detail]
+        zips = template_zctas(template, zcta_data)
+        key = tuple(zips)
+        if key not in labels:
+            with instrumentation.timer('svg.day_labels'):
+                labels[key] = day_dataframe_to_aria_labels(zcta_data, zips)
+                days[key] = zcta_data.xs(date, level=1).reindex(zips)
+        with instrumentation.timer('svg.frame'):
+            _write_day_svg(template, labels[key], days[key][spec.plot_field], date, spec.legend_title, spec.min_rate, spec.max_rate, spec.colormap, svg_filename(spec.filename_prefix, spec.plot_field, spec.colormap, date))
+
+def mi_generate_animation_from_one_dataframe(data, plot_field='COVID_CASE_RATE', legend_title=None, filename_prefix='NYC', colormap='rainbow', dates=None, min_rate=None, max_rate=None, verbose=True, detail='full'):
+    r'''
+    Generate a compact animation file holding the maps of NYC (by ZCTA) for
+    each specified date, colored according to value of some data and a
+    specified color palette.
+
+    Rather than a full svg per date, as made by
+    'mi_generate_multiple_svgs_from_one_dataframe', the map's geometry (the
+    compiled template) is written once and each date only stores its fill
+    colors, aria-label values and legend text. The svgs can be recreated
+    from it with 'materialize_animation_frame' and 'materialize_animation'.
+
+    Parameters
+    ----------
+    The parameters 'data', 'plot_field', 'legend_title', 'filename_prefix',
+    'colormap', 'dates', 'min_rate', 'max_rate', 'verbose' and 'detail' are
+    the same as those of 'mi_generate_multiple_svgs_from_one_dataframe'.
+
+    Returns
+    -------
+    str
+        The name of the animation file created, which is
+        'filename_prefix_plot_field_colormap.json.gz'.
+
+    '''
+    locale.setlocale(locale.LC_ALL, '')
+    if legend_title is None:
+        legend_title = plot_field
+    dates, min_rate, max_rate = _dates_and_range(data, plot_field, dates, min_rate, max_rate)
+    template = load_compiled_template(colormap, detail)
+    zips = template_zctas(template, data)
+    
+    frames = []
     for date in dates:
         if verbose:
-            print(date)
-        mi_generate_svg_from_day_dataframe(data.loc[pd.IndexSlice[:, date], :], plot_field=plot_field, legend_title=legend_title, filename_prefix=filename_prefix, min_rate=min_rate, max_rate=max_rate, colormap=colormap)
-    return
+            instrumentation.log_event('frame_computed', date=date.strftime('%Y-%m-%d'))
+        zcta_data = data.loc[pd.IndexSlice[:, date], :]
+        slot_values = legend_slot_values(date, legend_title, min_rate, max_rate)
+        frames.append({
+            'filename' : filename_prefix + "_" + plot_field + "_" + colormap + "_" + date.strftime("%Y-%m-%d-%H-%M-%S") + ".svg",
+            'fills' : values_to_rgb_strings(zcta_data.xs(date, level=1).reindex(zips)[plot_field], min_rate, max_rate, colormap),
+            'labels' : day_dataframe_to_label_values(zcta_data, zips),
+            'legend' : [slot_values[slot] for slot in template.footer_slots]
+            })
+    
+    filename = filename_prefix + "_" + plot_field + "_" + colormap + ".json.gz"
+    with gzip.open(filename, 'wt', encoding='utf-8') as outfile:
+        json.dump({'template' : template._asdict(), 'frames' : frames}, outfile, separators=(',', ':'))
+    return filename
+
+def load_animation(filename):
+    r'''
+    Read an animation file created by
+    'mi_generate_animation_from_one_dataframe'.
+
+    Returns
+    -------
+    dict
+        A dictionary whose 'template' is a CompiledTemplate and whose
+        'frames' is a list with the record of each date.
+
+    '''
+    with gzip.open(filename, 'rt', encoding='utf-8') as infile:
+        animation = json.load(infile)
+    animation['template'] = CompiledTemplate(**animation['template'])
+    return animation
+
+def materialize_animation_frame(animation, n):
+    r'''
+    Recreate the svg of one date of an animation.
+
+    Parameters
+    ----------
+    animation : str or dict
+        The name of an animation file, or the animation as returned by
+        'load_animation' (which is faster when materializing many frames).
+    n : int
+        The index of the frame (i.e. date) to recreate.
+
+    Returns
+    -------
+    str
+        The contents of the svg file, identical to the one that would have
+        been created by 'mi_generate_svg_from_day_dataframe'.
+
+    '''
+    if isinstance(animation, str):
+        animation = load_animation(animation)
+    template = animation['template']
+    frame = animation['frames'][n]
+    labels = [aria_label_format%tuple(values) for values in frame['labels']]
+    slot_values = dict(zip(template.footer_slots, frame['legend']))
+    return assemble_svg(template, labels, frame['fills'], slot_values)
+
+def materialize_animation(filename):
+    r'''
+    Recreate the svg files of every date of an animation, under the names
+    'mi_generate_multiple_svgs_from_one_dataframe' would have given them.
+
+    Returns
+    -------
+    None.
+
+    '''
+    animation = load_animation(filename)
+    for n, frame in enumerate(animation['frames']):
+        write_svg([materialize_animation_frame(animation, n)], frame['filename'])
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+Keep a set of svg maps of the NYC Covid-19 data up to date as new commits
+arrive in the coronavirus-data repository, doing only the work the new data
+calls for.
+
+Each time the repository's HEAD moves:
+    - only the dates of the new commits are read and cleaned (with the cache
+      of 'clean_data.read_all_zcta_data'),
+    - the derived metrics (see 'derived_metrics') are only recomputed from
+      the first date whose data changed,
+    - only the svgs of the dates whose plotted values or labels changed are
+      written again.
+
+The repository is polled from an asyncio event loop (see 'watch'), with the
+updates themselves run in a thread, e.g.
+
+    watcher = FrameWatcher('../coronavirus-data/', 'zcta_cache', ['COVID_CASE_RATE'], 'COVID_CASE_RATE_DIFF_SMA3', min_rate=-50, max_rate=50)
+    asyncio.run(watch(watcher, interval=600))
+
+The first update makes every svg, as the make_* scripts do.
+
+"""
+
+import asyncio
+import subprocess
+import numpy as np
+import pandas as pd
+
+import svg_utilities
+import clean_data
+import derived_metrics
+import zcta_arrays
+import instrumentation
+
+class FrameWatcher:
+    r'''
+    The state of a set of svg maps made from a coronavirus-data repository,
+    and what is needed to bring them up to date.
+
+    Parameters
+    ----------
+    data_dir : str
+        Folderpath to the coronavirus-data repository.
+    cache_dir : str
+        Folderpath of the cache of 'clean_data.read_all_zcta_data'. With
+        None, the whole history is read again on each update.
+    fields : list
+        The fields from which to derive metrics.
+    plot_field : str
+        The field plotted, e.g. 'COVID_CASE_RATE_DIFF_SMA3'.
+    start_date : pandas.Timestamp (or str), optional
+        The first date for which to make an svg.
+        The default is None. Every date then gets one.
+    sma_windows, ema_spans, growth_periods
+        The parameters of 'derived_metrics.compute_derived_metrics'. The
+        defaults are (3,), () and ().
+    **render_kwargs
+        The parameters 'legend_title', 'filename_prefix', 'colormap',
+        'min_rate', 'max_rate', 'workers' and 'detail' of
+        'svg_utilities.mi_generate_multiple_svgs_from_one_dataframe'. If
+        'min_rate' or 'max_rate' are not given and the range of the values
+        changes, every svg is made again.
+
+    '''
+    def __init__(self, data_dir, cache_dir, fields, plot_field, start_date=None, sma_windows=(3,), ema_spans=(), growth_periods=(), **render_kwargs):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.fields = list(fields)
+        self.plot_field = plot_field
+        self.start_date = None if start_date is None else pd.Timestamp(start_date)
+        self.derived_kwargs = {'sma_windows': sma_windows, 'ema_spans': ema_spans, 'growth_periods': growth_periods}
+        self.render_kwargs = render_kwargs
+        # The HEAD, data (with derived metrics), derived arrays and range of
+        # values of the last update
+        self.head = None
+        self.data = None
+        self.derived = None
+        self.rate_range = None
+
+    def update(self, head=None):
+        r'''
+        Bring the svgs up to date with the repository.
+
+        Parameters
+        ----------
+        head : str, optional
+            The commit at the repository's HEAD, if already known.
+            The default is None. It is then read with 'read_head'.
+
+        Returns
+        -------
+        list
+            The dates whose svg was made, as pandas.Timestamp's. Empty if the
+            repository hasn't changed.
+
+        '''
+        if head is None:
+            head = read_head(self.data_dir)
+        if head == self.head:
+            return []
+        instrumentation.count('watch.updates')
+
+        with instrumentation.timer('watch.ingest'):
+            data = clean_data.read_all_zcta_data(self.data_dir, cache_dir=self.cache_dir)
+
+        # Only recompute the derived metrics from the first changed date on
+        with instrumentation.timer('watch.derive'):
+            arrays = zcta_arrays.zcta_arrays_from_dataframe(data[self.fields], dtype='float64')
+            derived = derived_metrics.compute_derived_metrics(arrays, self.fields, previous=_unchanged_derived_arrays(self.derived, arrays, self.fields), **self.derived_kwargs)
+            names = [name for field in self.fields for name in derived_metrics.derived_metric_names(field, **self.derived_kwargs)]
+            data = derived_metrics.add_derived_arrays(data, derived, names)
+
+        # Only make the svgs of the dates whose values changed, unless the
+        # range of the colormap did
+        with instrumentation.timer('watch.compare'):
+            dates = data.index.levels[1]
+            if self.start_date is not None:
+                dates = dates[dates >= self.start_date]
+            dates, min_rate, max_rate = svg_utilities._dates_and_range(data, self.plot_field, dates, self.render_kwargs.get('min_rate'), self.render_kwargs.get('max_rate'))
+            if self.data is not None and (min_rate, max_rate) == self.rate_range:
+                dates = changed_dates(self.data, data, [self.plot_field] + list(dict.fromkeys(svg_utilities.fields_to_data_by_modzcta_dict.values())), dates)
+
+        with instrumentation.timer('watch.render'):
+            if len(dates):
+                render_kwargs = dict(self.render_kwargs, min_rate=min_rate, max_rate=max_rate)
+                svg_utilities.mi_generate_multiple_svgs_from_one_dataframe(data, plot_field=self.plot_field, dates=dates, **render_kwargs)
+        instrumentation.count('watch.frames_rendered', len(dates))
+
+        self.head = head
+        self.data = data
+        self.derived = derived
+        self.rate_range = (min_rate, max_rate)
+        return list(dates)
+
+def _unchanged_derived_arrays(derived, arrays, fields):
+    # The part of the derived arrays of the last update before the first date
+    # whose fields have changed, or None if there is no such part
+    if derived is None or not np.array_equal(derived.zctas, arrays.zctas) or arrays.dates[0] != derived.dates[0]:
+        return None
+    arrays = derived_metrics.to_daily_calendar(arrays)
+    n = min(len(arrays.dates), len(derived.dates))
+    changed = np.zeros(n, dtype=bool)
+    for field in fields:
+        old = derived.metrics[field][:, :n]
+        new = arrays.metrics[field][:, :n]
+        changed |= ((old != new) & ~(np.isnan(old) & np.isnan(new))).any(axis=0)
+    first_changed = np.argmax(changed) if changed.any() else n
+    if first_changed == 0:
+        return None
+    return zcta_arrays.ZCTAArrays(derived.zctas, derived.dates[:first_changed], {name: values[:, :first_changed] for name, values in derived.metrics.items()}, derived.zcta_info)
+
+def changed_dates(old, new, fields, dates):
+    r'''
+    Find the dates for which some fields differ between two versions of the
+    data.
+
+    Parameters
+    ----------
+    old, new : pandas.DataFrame
+        pandas.DataFrame's with multiindex whose level 0 are the ZCTA and
+        whose level 1 are pandas.Timestamp's representing the dates of the
+        data.
+    fields : list
+        The fields to compare. A field whose dtype differs (and so is
+        formatted differently) differs on every date.
+    dates : pandas.DatetimeIndex
+        The dates to compare.
+
+    Returns
+    -------
+    pandas.DatetimeIndex
+        The dates among 'dates' for which some of the fields differ, or
+        which are missing from 'old'. A ZCTA missing from one version is
+        taken to have NaN values.
+
+    '''
+    fields = [field for field in fields if field in old or field in new]
+    if any(field not in old or field not in new or old[field].dtype != new[field].dtype for field in fields):
+        return dates
+    old = old.loc[old.index.get_level_values(1).isin(dates), fields]
+    new = new.loc[new.index.get_level_values(1).isin(dates), fields]
+    missing = ~dates.isin(old.index.get_level_values(1).unique())
+    index = new.index.union(old.index)
+    old = old.reindex(index)
+    new = new.reindex(index)
+    differs = ((old != new) & ~(old.isnull() & new.isnull())).any(axis=1).to_numpy()
+    changed = index.get_level_values(1)[differs].unique()
+    return dates[dates.isin(changed) | missing]
+
+def read_head(data_dir):
+    r'''
+    Get the commit at the HEAD of a repository.
+    '''
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=data_dir, capture_output=True, check=True, universal_newlines=True).stdout.strip()
+
+async def read_head_async(data_dir):
+    r'''
+    Get the commit at the HEAD of a repository, without blocking the event
+    loop.
+    '''
+    process = await asyncio.create_subprocess_exec('git', 'rev-parse', 'HEAD', cwd=data_dir, stdout=asyncio.subprocess.PIPE)
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError("git rev-parse HEAD failed in " + data_dir)
+    return stdout.decode().strip()
+
+async def watch(watcher, interval=600, stop=None):
+    r'''
+    Poll a repository for new commits and bring the svgs of a watcher up to
+    date each time there are some.
+
+    The updates run in a thread of the event loop's default executor, so
+    that the loop keeps polling (and serving anything else running on it).
+    A poll or update that fails (e.g. git being unavailable while the
+    repository is pulled) is logged as an 'update_failed' event and tried
+    again at the next poll; the watcher is only changed by updates that
+    finish.
+
+    Parameters
+    ----------
+    watcher : FrameWatcher
+        What to keep up to date.
+    interval : float, optional
+        The number of seconds between polls.
+        The default is 600.
+    stop : asyncio.Event, optional
+        An event on which to stop watching.
+        The default is None. The watching then goes on until cancelled.
+
+    Returns
+    -------
+    None.
+
+    '''
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event() if stop is None else stop
+    while not stop.is_set():
+        head = None
+        try:
+            head = await read_head_async(watcher.data_dir)
+            if head != watcher.head:
+                instrumentation.log_event('update_started', head=head)
+                dates = await loop.run_in_executor(None, watcher.update, head)
+                instrumentation.log_event('update_finished', head=head, svgs_written=len(dates))
+        except Exception as error:
+            # Keep watching, and try again at the next poll
+            instrumentation.log_event('update_failed', head=head, error=repr(error))
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    return
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+A compact, columnar representation of the cleaned NYC Covid-19 data.
+
+Rather than one long DataFrame with a (MODIFIED_ZCTA, DATA_DATE) multiindex,
+each numerical field is kept as a dense array of shape (n_zcta, n_dates) with
+NaN wherever there is no data, alongside the sorted ZCTAs and dates and a
+small table of the information that doesn't change over time (neighborhood,
+borough, population). Row i of an array is the history of ZCTA zctas[i] and
+column j is the data of day dates[j]; both are views, not copies. The arrays
+are stored column-major (Fortran order), so that the data of a day, which is
+what rendering a map reads, is contiguous, while the history of a ZCTA is a
+strided view.
+
+The arrays can be saved to a directory of .npy files and loaded back
+memory-mapped, so only the parts that are used get read from disk.
+
+"""
+
+import os
+import json
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# The fields that don't change over time and so are kept once per ZCTA
+zcta_info_fields = ['NEIGHBORHOOD_NAME', 'BOROUGH_GROUP', 'POP_DENOMINATOR']
+
+# The cleaned data in columnar form:
+#   zctas : sorted numpy.ndarray of the ZCTAs
+#   dates : sorted numpy.ndarray (of dtype datetime64[ns]) of the dates
+#   metrics : dict from field name to numpy.ndarray of shape (n_zcta, n_dates),
+#       in Fortran order
+#   zcta_info : pandas.DataFrame indexed by the ZCTAs of 'zcta_info_fields'
+ZCTAArrays = namedtuple('ZCTAArrays', ['zctas', 'dates', 'metrics', 'zcta_info'])
+
+def zcta_arrays_from_dataframe(data, dtype='float32'):
+    r'''
+    Convert data as returned by 'clean_data.read_all_zcta_data' to arrays.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 are pandas.Timestamp's representing the dates of the
+        data.
+    dtype : str (or numpy.dtype), optional
+        The dtype of the metric arrays. Note that float32 only keeps about
+        7 significant digits; use float64 to keep the values exactly.
+        The default is 'float32'.
+
+    Returns
+    -------
+    ZCTAArrays
+        The same data in columnar form. Every numerical column of 'data' not
+        in 'zcta_info_fields' becomes a metric.
+
+    '''
+    zcta_codes, zctas = pd.factorize(data.index.get_level_values(0), sort=True)
+    date_codes, dates = pd.factorize(data.index.get_level_values(1), sort=True)
+
+    metrics = {}
+    for field in data.columns:
+        if field in zcta_info_fields or not pd.api.types.is_numeric_dtype(data[field]):
+            continue
+        values = np.full((len(zctas), len(dates)), np.nan, dtype=dtype, order='F')
+        values[zcta_codes, date_codes] = data[field].to_numpy(dtype=dtype)
+        metrics[field] = values
+
+    # Take the most recent non-null value of each time-independent field
+    zcta_info = pd.DataFrame(index=pd.Index(zctas, name=data.index.names[0]))
+    for field in zcta_info_fields:
+        if field in data:
+            latest = data[field].dropna().groupby(level=0).last()
+            zcta_info[field] = latest.reindex(zcta_info.index)
+
+    return ZCTAArrays(np.asarray(zctas), np.asarray(dates, dtype='datetime64[ns]'), metrics, zcta_info)
+
+def zcta_arrays_to_dataframe(arrays, dates=None):
+    r'''
+    Convert arrays back to a DataFrame like those of
+    'clean_data.read_all_zcta_data', e.g. for use with 'svg_utilities'.
+
+    Parameters
+    ----------
+    arrays : ZCTAArrays
+        The data in columnar form.
+    dates : listable, optional
+        The dates to include.
+        The default is None. All dates are then included.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        A pandas.DataFrame with multiindex whose level 0 are the ZCTA and
+        whose level 1 are the dates. Pairs of ZCTA and date for which every
+        metric is NaN are left out.
+
+    '''
+    date_indices = slice(None) if dates is None else date_positions(arrays, dates)
+    selected_dates = arrays.dates[date_indices]
+    index = pd.MultiIndex.from_product([arrays.zctas, pd.DatetimeIndex(selected_dates)], names=[arrays.zcta_info.index.name, 'DATA_DATE'])
+    data = pd.DataFrame({field: values[:, date_indices].ravel() for field, values in arrays.metrics.items()}, index=index)
+    data = data[data.notnull().any(axis=1)]
+    data.index = data.index.remove_unused_levels()
+    for field in arrays.zcta_info:
+        data[field] = arrays.zcta_info[field].reindex(data.index.get_level_values(0)).to_numpy()
+    return data
+
+def date_positions(arrays, dates):
+    r'''
+    Get the positions of some dates in 'arrays.dates'.
+
+    Raises
+    ------
+    KeyError
+        If one of the dates is not in 'arrays.dates'.
+
+    '''
+    dates = np.asarray(pd.DatetimeIndex(np.atleast_1d(dates)), dtype='datetime64[ns]')
+    positions = np.searchsorted(arrays.dates, dates)
+    found = positions < len(arrays.dates)
+    found[found] = arrays.dates[positions[found]] == dates[found]
+    if not found.all():
+        raise KeyError("No data for %s"%(list(pd.DatetimeIndex(dates[~found]).strftime('%Y-%m-%d'))))
+    return positions
+
+def day_slice(arrays, field, date):
+    r'''
+    Get the values of one field for every ZCTA on one date (as a contiguous
+    view).
+    '''
+    return arrays.metrics[field][:, date_positions(arrays, date)[0]]
+
+def zcta_series(arrays, field, zcta):
+    r'''
+    Get the values of one field for one ZCTA on every date (as a strided
+    view).
+    '''
+    position = np.searchsorted(arrays.zctas, zcta)
+    if position == len(arrays.zctas) or arrays.zctas[position] != zcta:
+        raise KeyError(zcta)
+    return arrays.metrics[field][position]
+
+def save_zcta_arrays(arrays, path):
+    r'''
+    Save arrays to a directory, with one .npy file per array.
+
+    Parameters
+    ----------
+    arrays : ZCTAArrays
+        The data in columnar form.
+    path : str
+        Folderpath of the directory to save to. It is created if needed.
+
+    Returns
+    -------
+    None.
+
+    '''
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'zctas.npy'), arrays.zctas)
+    np.save(os.path.join(path, 'dates.npy'), arrays.dates)
+    for i, (field, values) in enumerate(arrays.metrics.items()):
+        np.save(os.path.join(path, 'metric%s.npy'%(i)), values)
+    arrays.zcta_info.to_csv(os.path.join(path, 'zcta_info.csv'))
+    with open(os.path.join(path, 'metrics.json'), 'w') as metrics_file:
+        json.dump(list(arrays.metrics), metrics_file)
+
+def load_zcta_arrays(path, mmap_mode='r'):
+    r'''
+    Load arrays saved with 'save_zcta_arrays'.
+
+    Parameters
+    ----------
+    path : str
+        Folderpath of the directory the arrays were saved to.
+    mmap_mode : str, optional
+        How to memory-map the metric arrays (see numpy.load).
+        The default is 'r'. Use None to read them into memory.
+
+    Returns
+    -------
+    ZCTAArrays
+        The data in columnar form.
+
+    '''
+    with open(os.path.join(path, 'metrics.json'), 'r') as metrics_file:
+        fields = json.load(metrics_file)
+    metrics = {field: np.load(os.path.join(path, 'metric%s.npy'%(i)), mmap_mode=mmap_mode) for i, field in enumerate(fields)}
+    zctas = np.load(os.path.join(path, 'zctas.npy'))
+    dates = np.load(os.path.join(path, 'dates.npy'))
+    zcta_info = pd.read_csv(os.path.join(path, 'zcta_info.csv'), index_col=0)
+    return ZCTAArrays(zctas, dates, metrics, zcta_info)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on October 2026
+
+An on-disk store of the cleaned NYC Covid-19 data, partitioned by date, for
+histories too long to hold in memory at once.
+
+The data of each date is kept in its own file, dates/YYYY-MM-DD.npz, with one
+array per column (and one of the ZCTAs), so reading a range of dates only
+reads their files, and only the columns asked for. A manifest records the
+commit each date was read from and the columns and dtypes of the whole
+store, so that what is read back is the same as what
+'clean_data.read_all_zcta_data' returns for those dates.
+
+The store is written by 'write_zcta_store', which reads and cleans the
+commits a chunk at a time, from the most recent, and only keeps a chunk and
+the last record of each ZCTA in memory. Later calls only read the commits
+that have changed. For example,
+
+    zcta_store.write_zcta_store('../coronavirus-data/', 'zcta_store')
+    for dates, data in zcta_store.iter_zcta_store_windows('zcta_store', start='2020-05-20', lookback_days=4):
+        ...
+
+goes through the data 30 dates at a time, with 4 days of data before each
+window (e.g. for 'derived_metrics.add_derived_metrics').
+
+"""
+
+import os
+import shutil
+import subprocess
+import numpy as np
+import pandas as pd
+
+import clean_data
+import instrumentation
+
+# The kinds of cleaning rules whose fields are set from the most recent
+# record of each ZCTA (see 'clean_data.zcta_cleaning_rules')
+_backfill_kinds = ('backfill_latest', 'backfill_constant')
+
+def write_zcta_store(data_dir='../coronavirus-data/', store_dir='zcta_store', chunk_size=30, cache_dir=None, workers=None):
+    r'''
+    Read, clean and write the zcta data of every date to a store, or bring
+    the store up to date with the repository.
+
+    The commits are read and cleaned 'chunk_size' at a time, from the most
+    recent. The fields filled in from the most recent record of each ZCTA
+    (see 'clean_data.zcta_cleaning_rules') are taken from the records
+    already cleaned; the rare dates written before a more recent value was
+    found are updated at the end.
+
+    Parameters
+    ----------
+    data_dir : str, optional
+        Folderpath to the coronavirus-data repository.
+        The default is '../coronavirus-data/'.
+    store_dir : str, optional
+        Folderpath of the store. It is created if needed.
+        The default is 'zcta_store'.
+    chunk_size : int, optional
+        The number of commits read and cleaned at once.
+        The default is 30.
+    cache_dir : str, optional
+        Folderpath of a cache of the data of each commit (see
+        'clean_data.read_zcta_data_of_commits').
+        The default is None. Nothing is then cached.
+    workers : int, optional
+        The number of threads parsing the files read from the repository.
+        The default is None (see 'clean_data.read_zcta_data_of_commits').
+
+    Returns
+    -------
+    pandas.DatetimeIndex
+        The dates whose data was written.
+
+    '''
+    head = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=data_dir, capture_output=True, check=True, universal_newlines=True).stdout.strip()
+    manifest = clean_data._read_cache_manifest(store_dir)
+    if clean_data._cache_is_current(manifest) and manifest.get('head') == head:
+        return pd.DatetimeIndex([])
+
+    from git import Repo
+    repo = Repo(data_dir)
+    with instrumentation.timer('store.commit_history'):
+        commit_history = clean_data.select_data_commits(clean_data.read_commit_history(repo))
+    commits = dict(zip(commit_history['DATA_DATE'].dt.strftime('%Y-%m-%d'), commit_history['COMMIT']))
+
+    # Only write the dates whose commit has changed, unless some of the dates
+    # of the store are gone
+    cached_commits = manifest.get('commits')
+    if clean_data._cache_is_current(manifest) and cached_commits is not None and set(cached_commits) <= set(commits):
+        commit_history = commit_history[[cached_commits.get(date) != commit for date, commit in commits.items()]]
+        schema = manifest['schema']
+        state = _read_state(store_dir, commit_history['DATA_DATE'], schema)
+    else:
+        shutil.rmtree(os.path.join(store_dir, 'dates'), ignore_errors=True)
+        schema = {'columns': [], 'dtypes': {}, 'complete': {}}
+        state = None
+    os.makedirs(os.path.join(store_dir, 'dates'), exist_ok=True)
+
+    # Clean the commits a chunk at a time, from the most recent, each against
+    # the last record of each ZCTA of those cleaned before
+    commit_history = commit_history.sort_values('DATA_DATE', ascending=False)
+    latest = None if state is None else state.index.get_level_values(1).max()
+    stale = set()
+    for start in range(0, len(commit_history), chunk_size):
+        chunk = commit_history.iloc[start:start + chunk_size]
+        with instrumentation.timer('store.read_commits'):
+            data = clean_data.concat_zcta_data(clean_data.read_zcta_data_of_commits(repo, chunk, cache_dir, workers))
+        with instrumentation.timer('store.clean'):
+            data = clean_data.clean_zcta_data(data, state)
+            last = _last_records(data)
+            if state is not None:
+                stale |= _changed_zctas(state, last)
+            state = last
+        with instrumentation.timer('store.write'):
+            data_dates = data.index.get_level_values(1)
+            for date in chunk['DATA_DATE']:
+                # Dates whose every record was dropped get no file
+                filename = _partition_filename(store_dir, date)
+                partition = data[data_dates == date]
+                if len(partition):
+                    _write_partition(partition, filename)
+                    _add_to_schema(schema, partition, latest is None or date > latest)
+                    latest = date if latest is None else max(latest, date)
+                elif os.path.exists(filename):
+                    os.remove(filename)
+        instrumentation.count('store.dates_written', len(chunk))
+
+    # Update the records of the dates cleaned before a more recent value of
+    # a backfilled field of their ZCTA was found
+    if stale:
+        with instrumentation.timer('store.refill'):
+            for date in zcta_store_dates(store_dir):
+                partition = _read_partition(_partition_filename(store_dir, date), _store_columns(schema), schema['dtypes'])
+                refilled = _refill(partition, state, stale)
+                if refilled is not None:
+                    _write_partition(refilled, _partition_filename(store_dir, date))
+                    instrumentation.count('store.dates_refilled')
+
+    clean_data._write_pickle(state, os.path.join(store_dir, 'state.pkl'))
+    clean_data._write_cache_manifest(store_dir, dict(clean_data._cache_versions(), head=head, commits=commits, schema=schema))
+    return pd.DatetimeIndex(commit_history['DATA_DATE']).sort_values()
+
+def read_zcta_store(store_dir='zcta_store', start=None, end=None, columns=None):
+    r'''
+    Read the data of a range of dates from a store.
+
+    Parameters
+    ----------
+    store_dir : str, optional
+        Folderpath of the store.
+        The default is 'zcta_store'.
+    start : pandas.Timestamp (or str), optional
+        The first date to read.
+        The default is None. The data is then read from the first date.
+    end : pandas.Timestamp (or str), optional
+        The last date to read.
+        The default is None. The data is then read up to the last date.
+    columns : list, optional
+        The columns to read.
+        The default is None. Every column is then read.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The data of those dates, as returned by
+        'clean_data.read_all_zcta_data'.
+
+    '''
+    schema = clean_data._read_cache_manifest(store_dir)['schema']
+    if columns is None:
+        columns = _store_columns(schema)
+    dates = zcta_store_dates(store_dir)
+    if start is not None:
+        dates = dates[dates >= pd.Timestamp(start)]
+    if end is not None:
+        dates = dates[dates <= pd.Timestamp(end)]
+
+    with instrumentation.timer('store.read'):
+        partitions = [_read_partition_arrays(_partition_filename(store_dir, date), columns, schema['dtypes']) for date in dates]
+    lengths = [len(zctas) for zctas, values in partitions]
+    zctas = np.concatenate([zctas for zctas, values in partitions]) if partitions else np.array([], dtype=int)
+    data_dates = np.repeat(np.asarray(dates, dtype='datetime64[ns]'), lengths)
+    rows = np.lexsort((data_dates, zctas))
+    index = pd.MultiIndex.from_arrays([zctas[rows], data_dates[rows]], names=['MODIFIED_ZCTA', 'DATA_DATE'])
+    data = {}
+    for column in columns:
+        values = np.empty(len(zctas), dtype=schema['dtypes'][column])
+        offset = 0
+        for length, (partition_zctas, partition_values) in zip(lengths, partitions):
+            values[offset:offset + length] = partition_values[column]
+            offset += length
+        data[column] = values[rows]
+    return pd.DataFrame(data, index=index, columns=columns)
+
+def iter_zcta_store_windows(store_dir='zcta_store', start=None, end=None, dates_per_window=30, lookback_days=0, columns=None):
+    r'''
+    Read the data of a store a window of dates at a time.
+
+    Parameters
+    ----------
+    store_dir, start, end, columns
+        The same as those of 'read_zcta_store'.
+    dates_per_window : int, optional
+        The number of dates of each window.
+        The default is 30.
+    lookback_days : int, optional
+        The number of days before each window whose data is also read, e.g.
+        as given by 'derived_metrics.lookback_days'.
+        The default is 0.
+
+    Yields
+    ------
+    dates : pandas.DatetimeIndex
+        The dates of the window.
+    data : pandas.DataFrame
+        The data of those dates and of the days before them.
+
+    '''
+    dates = zcta_store_dates(store_dir)
+    if start is not None:
+        dates = dates[dates >= pd.Timestamp(start)]
+    if end is not None:
+        dates = dates[dates <= pd.Timestamp(end)]
+    for i in range(0, len(dates), dates_per_window):
+        window = dates[i:i + dates_per_window]
+        yield window, read_zcta_store(store_dir, window[0] - pd.Timedelta(days=lookback_days), window[-1], columns)
+
+def zcta_store_dates(store_dir='zcta_store'):
+    r'''
+    Get the dates with data in a store, as a sorted pandas.DatetimeIndex.
+    '''
+    filenames = [filename for filename in os.listdir(os.path.join(store_dir, 'dates')) if filename.endswith('.npz')]
+    return pd.DatetimeIndex(sorted(pd.Timestamp(filename[:-len('.npz')]) for filename in filenames))
+
+def _partition_filename(store_dir, date):
+    return os.path.join(store_dir, 'dates', pd.Timestamp(date).strftime('%Y-%m-%d') + '.npz')
+
+def _write_partition(partition, filename):
+    # Write the data of one date, to a temporary file first so an interrupted
+    # run never leaves a partial file in the store
+    arrays = {'MODIFIED_ZCTA': partition.index.get_level_values(0).to_numpy()}
+    arrays.update((column, partition[column].to_numpy()) for column in partition)
+    with open(filename + '.tmp', 'wb') as partition_file:
+        np.savez(partition_file, **arrays)
+    os.replace(filename + '.tmp', filename)
+
+def _read_partition_arrays(filename, columns, dtypes):
+    # The ZCTAs and the values of some columns of the data of one date, NaN
+    # for the columns it doesn't have
+    with np.load(filename, allow_pickle=True) as partition:
+        zctas = partition['MODIFIED_ZCTA']
+        values = {}
+        for column in columns:
+            if column in partition.files:
+                values[column] = partition[column].astype(dtypes[column], copy=False)
+            else:
+                values[column] = np.full(len(zctas), np.nan, dtype=dtypes[column])
+    return zctas, values
+
+def _read_partition(filename, columns, dtypes):
+    # The data of one date, as a DataFrame
+    zctas, values = _read_partition_arrays(filename, columns, dtypes)
+    date = pd.Timestamp(os.path.basename(filename)[:-len('.npz')])
+    index = pd.MultiIndex.from_arrays([zctas, np.full(len(zctas), np.datetime64(date, 'ns'))], names=['MODIFIED_ZCTA', 'DATA_DATE'])
+    return pd.DataFrame(values, index=index, columns=columns)
+
+def _add_to_schema(schema, partition, newest):
+    # Add the columns of a date's data to those of the store. The columns of
+    # the most recent date come first, and, as in
+    # 'clean_data.concat_zcta_data', integer columns missing from some dates
+    # become floats.
+    first = not schema['columns']
+    if newest:
+        schema['columns'] = list(partition.columns) + [column for column in schema['columns'] if column not in partition]
+    for column in partition:
+        dtype = partition[column].dtype
+        if column not in schema['dtypes']:
+            if not newest:
+                schema['columns'].append(column)
+            schema['dtypes'][column] = str(dtype)
+            schema['complete'][column] = first
+        elif dtype == object or schema['dtypes'][column] == 'object':
+            schema['dtypes'][column] = 'object'
+        else:
+            schema['dtypes'][column] = str(np.result_type(schema['dtypes'][column], dtype))
+    for column in schema['columns']:
+        if column not in partition:
+            schema['complete'][column] = False
+    for column in schema['columns']:
+        if not schema['complete'][column] and np.dtype(schema['dtypes'][column]).kind in 'biu':
+            schema['dtypes'][column] = 'float64'
+
+def _store_columns(schema):
+    # The columns of the store in the order 'clean_data.clean_zcta_data' puts
+    # them, with the backfilled fields last
+    backfilled = [field for rule in clean_data.zcta_cleaning_rules if rule.kind in _backfill_kinds for field in rule.fields]
+    return [column for column in schema['columns'] if column not in backfilled] + [field for field in backfilled if field in schema['columns']]
+
+def _last_records(data):
+    # The last record of each ZCTA
+    last = clean_data._is_last_of_run(data.index.get_level_values(0).to_numpy())
+    return data[last]
+
+def _changed_zctas(old, new):
+    # The ZCTAs of 'old' whose backfilled fields differ in 'new'
+    old_zctas = old.index.get_level_values(0).to_numpy(dtype=float)
+    new_zctas = new.index.get_level_values(0).to_numpy(dtype=float)
+    changed = np.zeros(len(old), dtype=bool)
+    for rule in clean_data.zcta_cleaning_rules:
+        if rule.kind in _backfill_kinds:
+            for field in rule.fields:
+                if field in new:
+                    old_values = old[field].to_numpy() if field in old else np.full(len(old), np.nan)
+                    new_values = clean_data._lookup_by_zcta(new_zctas, new[field].to_numpy(), old_zctas)
+                    changed |= ~((old_values == new_values) | (pd.isnull(old_values) & pd.isnull(new_values)))
+    return set(old.index.get_level_values(0)[changed])
+
+def _refill(partition, state, zctas):
+    # Set the backfilled fields of the records of 'zctas' to those of the last
+    # record of their ZCTA in 'state', and fill in the values computed from
+    # them, as 'clean_data.clean_zcta_data' does. None if nothing changes.
+    rows = partition.index.get_level_values(0).isin(list(zctas))
+    if not rows.any():
+        return None
+    refilled = partition.copy()
+    state_zctas = state.index.get_level_values(0).to_numpy(dtype=float)
+    partition_zctas = partition.index.get_level_values(0).to_numpy(dtype=float)
+    for rule in clean_data.zcta_cleaning_rules:
+        if rule.kind in _backfill_kinds:
+            for field in rule.fields:
+                values = refilled[field].to_numpy().copy()
+                values[rows] = clean_data._lookup_by_zcta(state_zctas, state[field].to_numpy(), partition_zctas[rows])
+                refilled[field] = values
+        elif rule.kind == 'fill_per_100k':
+            field, count_field = rule.fields
+            refilled[field] = refilled[field].fillna(100000 * refilled[count_field] / refilled['POP_DENOMINATOR'])
+    if refilled.equals(partition):
+        return None
+    return refilled
+
+def _read_state(store_dir, dates, schema):
+    # The last record of each ZCTA of the store, leaving out 'dates'
+    state_file = os.path.join(store_dir, 'state.pkl')
+    if not os.path.exists(state_file):
+        return None
+    state = pd.read_pickle(state_file)
+    dates = pd.DatetimeIndex(dates)
+    if not state.index.get_level_values(1).isin(dates).any():
+        return state
+    # Otherwise look for the last records in the other dates, from the most
+    # recent, until every ZCTA is found
+    wanted = set(state.index.get_level_values(0))
+    records = []
+    for date in zcta_store_dates(store_dir)[::-1]:
+        if not wanted:
+            break
+        if date in dates:
+            continue
+        partition = _read_partition(_partition_filename(store_dir, date), _store_columns(schema), schema['dtypes'])
+        partition = partition[partition.index.get_level_values(0).isin(list(wanted))]
+        records.append(partition)
+        wanted -= set(partition.index.get_level_values(0))
+    if not records:
+        return None
+    return pd.concat(records).sort_index()